@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def augment(course_factors, course_bias):
+    # [q_i, b_i] . [p_u, 1] ranks courses exactly like the model does for one user. The last
+    # column pads every item to the same norm, so the largest inner product is also the
+    # nearest item in L2 and k-means partitions line up with what a query retrieves.
+    items = np.column_stack([np.asarray(course_factors, dtype=np.float32),
+                             np.asarray(course_bias, dtype=np.float32)])
+    norms = np.einsum('ij,ij->i', items, items)
+    padding = np.sqrt(np.maximum(norms.max(initial=0.0) - norms, 0.0))
+    return np.column_stack([items, padding])
+
+
+class IVFIndex:
+    # Inverted file over k-means partitions: order[offsets[l]:offsets[l + 1]] are the course
+    # positions (model order) assigned to centroid l, all within radii[l] of it
+    def __init__(self, centroids, offsets, order, radii):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.order = order
+        self.radii = radii
+
+    @classmethod
+    def build(cls, course_factors, course_bias, n_lists=None, iterations=10, sample_size=256, seed=0):
+        items = augment(course_factors, course_bias)
+        n_items = len(items)
+        if n_lists is None:
+            n_lists = int(round(np.sqrt(n_items)))
+        n_lists = max(1, min(n_lists, n_items))
+
+        rng = np.random.default_rng(seed)
+        train = items
+        if n_items > sample_size * n_lists:
+            train = items[rng.choice(n_items, sample_size * n_lists, replace=False)]
+        centroids = train[rng.choice(len(train), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(train, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, train)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # Re-seed empty partitions from random points so every list stays in use
+            centroids[empty] = train[rng.choice(len(train), int(empty.sum()))]
+
+        assignment = _nearest(items, centroids)
+        order = np.argsort(assignment, kind='stable').astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+        radii = np.zeros(n_lists, dtype=np.float32)
+        np.maximum.at(radii, assignment, np.linalg.norm(items - centroids[assignment], axis=1))
+        return cls(centroids, offsets, order, radii)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def search(self, user_vector, n_probe=16, min_candidates=0):
+        # Course positions in the n_probe partitions with the highest possible score for the
+        # user, widened until there are at least min_candidates of them. No member of a
+        # partition can beat centroid . query + radius * |query|, so lists are probed in
+        # order of that bound rather than of centroid distance.
+        query = np.concatenate([np.asarray(user_vector, dtype=np.float32), [1.0, 0.0]])
+        bound = self.centroids @ query + self.radii * np.linalg.norm(query)
+        ranked = np.argsort(-bound)
+        sizes = np.diff(self.offsets)[ranked]
+        count = max(1, min(n_probe, len(ranked)))
+        if sizes[:count].sum() < min_candidates:
+            count = min(len(ranked), int(np.searchsorted(np.cumsum(sizes), min_candidates)) + 1)
+        return np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in ranked[:count]])
+
+
+def _nearest(points, centroids, block_size=65536):
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), block_size):
+        block = points[start:start + block_size]
+        # ||x - c||^2 without the ||x||^2 term, which is the same for every centroid
+        distances = centroid_norms - 2.0 * (block @ centroids.T)
+        assignment[start:start + block_size] = distances.argmin(axis=1)
+    return assignment
@@ -1,17 +1,42 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, make_response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, func, select
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+import click
 import numpy as np
-import pandas as pd
-from scipy.sparse.linalg import svds
-from sklearn.model_selection import train_test_split
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import json
+import math
+import multiprocessing
 import os
+import threading
+import time
+
+from cache import RecommendationCache, fingerprint
+from catalog import CourseCatalog
+from database import create_schema, make_engine, read_columns
+from evaluation import MetricsCache, cross_validate, holdout
+from ingest import IngestError, chunked, detect_format, iter_records, upsert_ratings, validate_chunk
+from instrumentation import instrument_flask, instrumented, peak_rss_bytes, profiler, registry
+from content import blend_content, profile_text
+from model import top_n_indices
+from model_store import ModelStore, train_and_publish
+from retrain import RetrainScheduler
+from throttle import SingleFlight, TokenBucketLimiter
+from trainers import get_trainer
 
 app = Flask(__name__)
 
+# Reverse proxies in front of the app (1 on Render). Each appends the address it saw to
+# X-Forwarded-For, so only that many entries from the right are trusted for remote_addr;
+# anything further left was written by the client.
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
 frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
 if os.environ.get('FLASK_ENV') == 'production':
     allowed_origins = [frontend_url] if frontend_url else ["*"]
@@ -26,13 +51,11 @@ CORS(app, resources={
     }
 }, supports_credentials=True)
 
-database_url = os.environ.get('DATABASE_URL', 'sqlite:///recommendations.db')
-if database_url.startswith('postgres://'):
-    engine = create_engine('sqlite:///recommendations.db', echo=False)
-else:
-    engine = create_engine(database_url, echo=False)
+engine = make_engine()
 Base = declarative_base()
 
+instrument_flask(app, engine)
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -58,13 +81,26 @@ class Rating(Base):
     rating = Column(Float)
     user = relationship('User', back_populates='ratings')
     course = relationship('Course', back_populates='ratings')
+    __table_args__ = (
+        # Also serves lookups by user_id alone
+        Index('uq_ratings_user_course', 'user_id', 'course_id', unique=True),
+        Index('ix_ratings_course_rating', 'course_id', 'rating'),
+    )
 
-Base.metadata.create_all(engine)
 Session = sessionmaker(bind=engine)
 
+def load_courses():
+    session = Session()
+    rows = session.query(Course.id, Course.title, Course.description, Course.category).order_by(Course.id).all()
+    session.close()
+    return rows
+
+course_catalog = CourseCatalog(load_courses)
+
 def init_sample_courses():
     session = Session()
     course_count = session.query(Course).count()
+    added = 0
     
     if course_count < 50:
         sample_courses = [
@@ -123,114 +159,175 @@ def init_sample_courses():
             Course(title="Figma Design Mastery", description="Prototyping and design systems", category="UI/UX Design"),
         ]
         
-        existing_titles = {c.title for c in session.query(Course).all()}
+        titles = [c.title for c in sample_courses]
+        existing_titles = {title for title, in session.query(Course.title).filter(Course.title.in_(titles))}
         new_courses = [c for c in sample_courses if c.title not in existing_titles]
         if new_courses:
             session.add_all(new_courses)
             session.commit()
+            course_catalog.invalidate()
+            added = len(new_courses)
     session.close()
+    return added
+
+def init_db():
+    # One-time setup, run once per deploy rather than in every worker that imports this module
+    create_schema(engine, Base.metadata)
+    return init_sample_courses()
 
-init_sample_courses()
+@app.cli.command('init-db')
+def init_db_command():
+    """Create missing tables and indexes and seed the sample courses."""
+    added = init_db()
+    click.echo(f'Database ready, {added} sample courses added')
 
+trainer = get_trainer()
+model_store = ModelStore()
 model_data = None
 
-class SVDModel:
-    def __init__(self, user_ids, course_ids, user_mean_ratings, course_mean_ratings, 
-                 user_factors, course_factors, global_mean):
-        self.user_ids = user_ids
-        self.course_ids = course_ids
-        self.user_mean_ratings = user_mean_ratings
-        self.course_mean_ratings = course_mean_ratings
-        self.user_factors = user_factors
-        self.course_factors = course_factors
-        self.global_mean = global_mean
-        self.user_id_to_idx = {uid: idx for idx, uid in enumerate(user_ids)}
-        self.course_id_to_idx = {cid: idx for idx, cid in enumerate(course_ids)}
-    
-    def predict(self, user_id, course_id):
-        if user_id not in self.user_id_to_idx or course_id not in self.course_id_to_idx:
-            return self.global_mean
-        
-        user_idx = self.user_id_to_idx[user_id]
-        course_idx = self.course_id_to_idx[course_id]
-        
-        user_bias = self.user_mean_ratings[user_idx] - self.global_mean
-        course_bias = self.course_mean_ratings[course_idx] - self.global_mean
-        interaction = np.dot(self.user_factors[user_idx], self.course_factors[course_idx])
-        
-        prediction = self.global_mean + user_bias + course_bias + interaction
-        prediction = max(1.0, min(5.0, prediction))
+ANN_ENABLED = os.environ.get('ANN_ENABLED', '0') == '1'
+ANN_MIN_COURSES = int(os.environ.get('ANN_MIN_COURSES', 10000))
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 16))
+
+def uses_ann(model):
+    return ANN_ENABLED and model is not None and len(model.course_ids) >= ANN_MIN_COURSES
+
+def publish_model(new_model):
+    global model_data
+    if uses_ann(new_model):
+        # Build the partitions before the model takes traffic
+        new_model.ann
+    previous = model_data
+    model_data = new_model
+    if previous is None or new_model is None or previous.version != new_model.version:
+        # Keys carry the model version, so the shared directory keeps other workers' fresh entries
+        recommendation_cache.clear(shared=False)
+
+def current_model():
+    reloaded = model_store.poll()
+    if reloaded is not None:
+        publish_model(reloaded)
+    return model_data
+
+_train_lock = threading.Lock()
+
+# Training in a separate process keeps its CPU time (and the GIL) away from request threads
+TRAIN_IN_SUBPROCESS = os.environ.get('TRAIN_IN_SUBPROCESS', '0') == '1'
+
+def train_in_subprocess(df, previous):
+    previous_version = previous.version if previous is not None else None
+    try:
+        # A fresh process per retrain: an idle trainer kept around would hold its whole heap in every worker
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            version = pool.submit(train_and_publish, trainer, df, model_store.directory, previous_version).result()
+        return model_store.load(version) if version else None
+    except (OSError, ValueError, KeyError, BrokenProcessPool):
+        app.logger.exception('Training subprocess failed, training in this worker instead')
+        return None
+
+RATINGS_FETCH_SIZE = int(os.environ.get('RATINGS_FETCH_SIZE', 50000))
+
+def ratings_frame(chunk_size=RATINGS_FETCH_SIZE):
+    # All ratings as a DataFrame over three arrays filled chunk by chunk, without ORM objects
+    import pandas as pd
+    with engine.connect() as conn:
+        expected = conn.execute(select(func.count()).select_from(Rating.__table__)).scalar()
+        user_ids, course_ids, ratings = read_columns(
+            conn, select(Rating.user_id, Rating.course_id, Rating.rating),
+            (np.int64, np.int64, np.float64), expected, chunk_size)
+    return pd.DataFrame({'user_id': user_ids, 'course_id': course_ids, 'rating': ratings}, copy=False)
+
+@instrumented('train_model')
+def train_model():
+    with _train_lock:
+        started = time.perf_counter()
+        df = ratings_frame()
+        if len(df) < 3:
+            return None
         
-        return prediction
+        new_model = train_in_subprocess(df, model_data) if TRAIN_IN_SUBPROCESS else None
+        if new_model is None:
+            new_model = trainer.train(df, previous=model_data)
+            try:
+                new_model = model_store.publish(new_model)
+            except (OSError, ValueError):
+                app.logger.exception('Could not persist model artifact, serving it from memory')
+        publish_model(new_model)
+        registry.set('recommender_model_last_train_duration_seconds', time.perf_counter() - started,
+                     'Wall time of the most recent full training run in this worker')
+        registry.set('recommender_model_last_train_timestamp_seconds', time.time(),
+                     'Unix time the most recent full training run in this worker finished')
+        return new_model
 
-def train_model_from_dataframe(df):
+@app.cli.command('train')
+@click.option('--chunk-size', default=RATINGS_FETCH_SIZE, show_default=True, help='Ratings fetched per round trip')
+def train_command(chunk_size):
+    """Train on every rating and publish the model for the web workers to load."""
+    started = time.perf_counter()
+    df = ratings_frame(chunk_size)
+    loaded = time.perf_counter()
+    click.echo(f'Loaded {len(df)} ratings in {loaded - started:.2f}s')
     if len(df) < 3:
-        return None
-    
-    user_ids = sorted(df['user_id'].unique())
-    course_ids = sorted(df['course_id'].unique())
-    
-    user_id_to_idx = {uid: idx for idx, uid in enumerate(user_ids)}
-    course_id_to_idx = {cid: idx for idx, cid in enumerate(course_ids)}
+        raise click.ClickException('Not enough ratings to train a model')
     
-    n_users = len(user_ids)
-    n_courses = len(course_ids)
-    rating_matrix = np.zeros((n_users, n_courses))
+    new_model = trainer.train(df, previous=model_store.load_current())
+    trained = time.perf_counter()
+    click.echo(f'Trained {trainer.name} model on {len(new_model.user_ids)} users and '
+               f'{len(new_model.course_ids)} courses in {trained - loaded:.2f}s')
     
-    for _, row in df.iterrows():
-        user_idx = user_id_to_idx[row['user_id']]
-        course_idx = course_id_to_idx[row['course_id']]
-        rating_matrix[user_idx, course_idx] = row['rating']
+    new_model = model_store.publish(new_model)
+    published = time.perf_counter()
+    click.echo(f'Published model {new_model.version} to {model_store.directory} in {published - trained:.2f}s')
     
-    global_mean = df['rating'].mean()
-    user_means = np.array([df[df['user_id'] == uid]['rating'].mean() for uid in user_ids])
-    course_means = np.array([df[df['course_id'] == cid]['rating'].mean() for cid in course_ids])
-    
-    normalized_matrix = rating_matrix.copy()
-    for i in range(n_users):
-        mask = rating_matrix[i] > 0
-        if mask.sum() > 0:
-            normalized_matrix[i, mask] -= user_means[i]
-    
-    n_factors = min(50, min(n_users, n_courses) - 1)
-    if n_factors < 1:
-        n_factors = 1
-    
-    if n_users == 1 or np.sum(normalized_matrix != 0) < 5:
-        user_factors = np.zeros((n_users, n_factors))
-        course_factors = np.zeros((n_courses, n_factors))
-    else:
-        try:
-            max_factors = min(n_factors, min(n_users, n_courses) - 1)
-            if max_factors < 1:
-                max_factors = 1
-            U, sigma, Vt = svds(normalized_matrix, k=max_factors)
-            sigma = np.diag(sigma)
-            user_factors = U @ np.sqrt(sigma)
-            course_factors = (np.sqrt(sigma) @ Vt).T
-        except:
-            user_factors = np.zeros((n_users, n_factors))
-            course_factors = np.zeros((n_courses, n_factors))
-    
-    return SVDModel(
-        user_ids, course_ids, user_means, course_means,
-        user_factors, course_factors, global_mean
-    )
+    peak = peak_rss_bytes()
+    peak_text = f', peak RSS {peak / 2 ** 20:.1f} MiB' if peak is not None else ''
+    click.echo(f'Done in {published - started:.2f}s{peak_text}')
 
-def train_model():
-    global model_data
+retrain_scheduler = RetrainScheduler(train_model)
+recommendation_cache = RecommendationCache()
+metrics_cache = MetricsCache()
+
+recommendation_flight = SingleFlight()
+metrics_flight = SingleFlight()
+training_flight = SingleFlight()
+
+def ensure_model():
+    # Requests that find no model share one training run instead of each queueing up their own
+    model = current_model()
+    if model is not None:
+        return model
+    return training_flight.do('train', lambda: model_data if model_data is not None else train_model())
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '0') == '1'
+rate_limiters = {
+    'recommendations': TokenBucketLimiter(float(os.environ.get('RATE_LIMIT_RECOMMENDATIONS_PER_SECOND', 10)),
+                                          float(os.environ.get('RATE_LIMIT_RECOMMENDATIONS_BURST', 30))),
+    'metrics': TokenBucketLimiter(float(os.environ.get('RATE_LIMIT_METRICS_PER_SECOND', 0.2)),
+                                  float(os.environ.get('RATE_LIMIT_METRICS_BURST', 5))),
+}
+
+def enforce_rate_limit(name):
+    if not RATE_LIMIT_ENABLED:
+        return
+    retry_after = rate_limiters[name].acquire(request.remote_addr)
+    if retry_after > 0:
+        abort(make_response(jsonify({'error': 'Too many requests, try again later'}), 429,
+                            {'Retry-After': str(math.ceil(retry_after))}))
+
+FOLD_IN_ENABLED = os.environ.get('FOLD_IN_ENABLED', '1') == '1'
+FOLD_IN_REGULARIZATION = float(os.environ.get('FOLD_IN_REGULARIZATION', 0.1))
+FOLD_IN_SGD_EPOCHS = int(os.environ.get('FOLD_IN_SGD_EPOCHS', 0))
+
+def fold_in_user(user_id):
+    # Personalize right away; the scheduled full retrain replaces this and bounds drift
+    model = model_data
+    if not FOLD_IN_ENABLED or model is None:
+        return
     session = Session()
-    ratings_data = session.query(Rating).all()
+    rows = session.query(Rating.course_id, Rating.rating).filter(Rating.user_id == user_id).all()
     session.close()
-    
-    if len(ratings_data) < 3:
-        return None
-    
-    ratings_list = [(r.user_id, r.course_id, r.rating) for r in ratings_data]
-    df = pd.DataFrame(ratings_list, columns=['user_id', 'course_id', 'rating'])
-    
-    model_data = train_model_from_dataframe(df)
-    return model_data
+    model.fold_in(user_id, [r[0] for r in rows], [r[1] for r in rows],
+                  reg=FOLD_IN_REGULARIZATION, sgd_epochs=FOLD_IN_SGD_EPOCHS)
 
 @app.route('/')
 def index():
@@ -241,9 +338,13 @@ def index():
             'GET /api/users/<id>': 'Get user by ID',
             'GET /api/courses': 'Get all courses',
             'POST /api/ratings': 'Create/update a rating',
+            'POST /api/ratings/bulk': 'Import ratings from a JSON array, NDJSON or CSV body',
             'GET /api/ratings/user/<id>': 'Get user ratings',
             'GET /api/recommendations/<id>': 'Get recommendations for user',
-            'GET /api/metrics': 'Get model evaluation metrics'
+            'POST /api/recommendations/batch': 'Get recommendations for many users',
+            'GET /api/metrics': 'Get model evaluation metrics',
+            'GET /api/internal/stats': 'Prometheus-format runtime metrics',
+            'GET|POST /api/internal/profile': 'Read or toggle the sampling profiler'
         }
     })
 
@@ -294,50 +395,118 @@ def delete_user(user_id):
     session.commit()
     session.close()
     
-    train_model()
+    fold_in_user(user_id)
+    recommendation_cache.evict_user(user_id)
+    retrain_scheduler.mark_dirty()
     
     return jsonify({'message': 'User and all ratings deleted successfully'})
 
 @app.route('/api/courses', methods=['GET'])
 def get_courses():
-    session = Session()
-    courses = session.query(Course).all()
-    result = [{
-        'id': c.id,
-        'title': c.title,
-        'description': c.description,
-        'category': c.category
-    } for c in courses]
-    session.close()
-    return jsonify(result)
+    catalog = course_catalog.get()
+    response = Response(catalog.json, mimetype='application/json')
+    response.set_etag(catalog.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/ratings', methods=['POST'])
 def create_rating():
     data = request.json
-    session = Session()
-    
-    existing = session.query(Rating).filter(
-        Rating.user_id == data['user_id'],
-        Rating.course_id == data['course_id']
-    ).first()
-    
-    if existing:
-        existing.rating = data['rating']
-    else:
-        rating = Rating(
-            user_id=data['user_id'],
-            course_id=data['course_id'],
-            rating=data['rating']
-        )
-        session.add(rating)
-    
-    session.commit()
-    session.close()
-    
-    train_model()
+    if not existing_user_ids([data['user_id']]):
+        return jsonify({'error': 'User not found'}), 404
+    if data['course_id'] not in course_catalog.get().by_id:
+        return jsonify({'error': 'Course not found'}), 404
+    with engine.begin() as conn:
+        upsert_ratings(conn, Rating.__table__, [{
+            'user_id': data['user_id'],
+            'course_id': data['course_id'],
+            'rating': data['rating']
+        }])
+    
+    fold_in_user(data['user_id'])
+    recommendation_cache.evict_user(data['user_id'])
+    retrain_scheduler.mark_dirty()
     
     return jsonify({'message': 'Rating saved successfully'})
 
+BULK_INGEST_CHUNK_SIZE = int(os.environ.get('BULK_INGEST_CHUNK_SIZE', 5000))
+BULK_INGEST_MAX_ERRORS = int(os.environ.get('BULK_INGEST_MAX_ERRORS', 1000))
+
+def existing_user_ids(user_ids):
+    session = Session()
+    try:
+        user_ids = list(user_ids)
+        found = set()
+        for start in range(0, len(user_ids), 500):
+            found.update(row[0] for row in session.query(User.id).filter(User.id.in_(user_ids[start:start + 500])))
+        return found
+    finally:
+        session.close()
+
+def ingest_ratings(stream, fmt):
+    # Yields one progress event per chunk, then a summary; commits chunk by chunk
+    catalog = course_catalog.get()
+    affected_users = set()
+    totals = {'rows': 0, 'upserted': 0, 'failed': 0}
+    error = None
+    
+    def records():
+        # A malformed body ends the import after the rows decoded before it
+        nonlocal error
+        try:
+            yield from iter_records(stream, fmt)
+        except IngestError as e:
+            error = e
+    
+    try:
+        for number, chunk in enumerate(chunked(records(), BULK_INGEST_CHUNK_SIZE), 1):
+            rows, errors = validate_chunk(chunk, existing_user_ids, catalog.by_id)
+            with engine.begin() as conn:
+                upsert_ratings(conn, Rating.__table__, rows)
+            affected_users.update(row['user_id'] for row in rows)
+            totals['rows'] += len(chunk)
+            totals['upserted'] += len(rows)
+            totals['failed'] += len(errors)
+            registry.inc('recommender_bulk_ingest_rows_total', len(rows), 'Rows accepted by bulk rating ingestion',
+                         status='upserted')
+            registry.inc('recommender_bulk_ingest_rows_total', len(errors), status='failed')
+            yield {'chunk': number, 'rows': len(chunk), 'upserted': len(rows), 'failed': len(errors),
+                   'first_row': chunk[0][0], 'last_row': chunk[-1][0], 'errors': errors}
+    finally:
+        # One retrain for the whole import, even if the body was malformed or the client went away
+        if affected_users:
+            recommendation_cache.evict_users(affected_users)
+            retrain_scheduler.mark_dirty()
+    
+    summary = dict(totals, done=True, users=len(affected_users))
+    if error is not None:
+        summary.update(error=str(error), error_row=error.row)
+    yield summary
+
+@app.route('/api/ratings/bulk', methods=['POST'])
+def bulk_ingest():
+    fmt = detect_format(request.mimetype, request.args.get('format'))
+    if fmt is None:
+        return jsonify({'error': 'Send a JSON array, NDJSON or CSV body (or pass ?format=json|ndjson|csv)'}), 415
+    events = ingest_ratings(request.stream, fmt)
+    
+    if request.args.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        def generate():
+            for event in events:
+                yield json.dumps(event) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    chunks, errors = [], []
+    for event in events:
+        if event.get('done'):
+            summary = event
+            break
+        chunk_errors = event.pop('errors')
+        errors.extend(chunk_errors[:BULK_INGEST_MAX_ERRORS - len(errors)])
+        chunks.append(event)
+    summary.update(chunks=chunks, errors=errors, errors_truncated=summary['failed'] > len(errors))
+    return jsonify(summary), 400 if 'error' in summary else 200
+
 @app.route('/api/ratings', methods=['DELETE'])
 def delete_rating():
     data = request.json
@@ -353,7 +522,9 @@ def delete_rating():
         session.commit()
         session.close()
         
-        train_model()
+        fold_in_user(data['user_id'])
+        recommendation_cache.evict_user(data['user_id'])
+        retrain_scheduler.mark_dirty()
         
         return jsonify({'message': 'Rating deleted successfully'})
     else:
@@ -371,218 +542,420 @@ def get_user_ratings(user_id):
     session.close()
     return jsonify(result)
 
+def course_payload(course, predicted_rating):
+    return {
+        'course_id': course.id,
+        'predicted_rating': predicted_rating,
+        'title': course.title,
+        'description': course.description,
+        'category': course.category
+    }
+
+def category_fallback(rated_courses, courses_by_id, n=10, content=None, content_weight=0.0):
+    ratings_by_category = defaultdict(list)
+    for course_id, rating in rated_courses.items():
+        course = courses_by_id.get(course_id)
+        if course:
+            ratings_by_category[course.category].append(rating)
+    
+    category_scores = {cat: np.mean(ratings) for cat, ratings in ratings_by_category.items()}
+    
+    course_ids = list(courses_by_id)
+    scores = np.array([category_scores.get(course.category, 3.0) for course in courses_by_id.values()],
+                      dtype=np.float64)
+    if content is not None:
+        blend_content(scores, content, content_weight)
+    scores[[i for i, course_id in enumerate(course_ids) if course_id in rated_courses]] = -np.inf
+    return [(course_ids[i], float(scores[i])) for i in top_n_indices(scores, n)]
+
+# Weight of the content score (course text vs the user's interests and skills) in the hybrid
+CONTENT_WEIGHT = float(os.environ.get('CONTENT_WEIGHT', 0.0))
+CONTENT_COLD_START_WEIGHT = float(os.environ.get('CONTENT_COLD_START_WEIGHT', 0.5))
+
+def content_weight(n_ratings):
+    return CONTENT_COLD_START_WEIGHT if n_ratings == 0 else CONTENT_WEIGHT
+
+def content_similarities(catalog, profiles, weights):
+    # Sparse (len(profiles), len(catalog)) similarities, or None when nothing would use them
+    if not any(profile and weight > 0 for profile, weight in zip(profiles, weights)):
+        return None
+    return catalog.content.similarities(profiles)
+
+# Users with this many ratings or fewer are scored from the neighbors of what they rated
+COLD_START_MAX_RATINGS = int(os.environ.get('COLD_START_MAX_RATINGS', 2))
+HIGH_RATING = 4.0
+
 @app.route('/api/recommendations/<int:user_id>', methods=['GET'])
 def get_recommendations(user_id):
-    global model_data
-    
+    enforce_rate_limit('recommendations')
+    catalog = course_catalog.get()
     session = Session()
     
-    all_courses = session.query(Course).all()
     user_ratings = session.query(Rating).filter(Rating.user_id == user_id).all()
-    rated_course_ids = {r.course_id for r in user_ratings}
+    user_rated_courses = {r.course_id: r.rating for r in user_ratings}
+    rated_course_ids = set(user_rated_courses)
+    user = session.get(User, user_id)
+    profile = profile_text(user.interests, user.skills) if user else ''
+    session.close()
     
-    if len(rated_course_ids) >= len(all_courses):
-        session.close()
+    if len(rated_course_ids) >= len(catalog):
         return jsonify({
             'recommendations': [],
             'explanations': {},
             'message': 'You have rated all available courses!'
         })
     
-    if model_data is None:
-        train_model()
-    
-    if model_data is None:
-        user_rated_courses = {r.course_id: r.rating for r in user_ratings}
-        avg_ratings_by_category = {}
-        for r in user_ratings:
-            course = session.query(Course).filter(Course.id == r.course_id).first()
-            if course:
-                if course.category not in avg_ratings_by_category:
-                    avg_ratings_by_category[course.category] = []
-                avg_ratings_by_category[course.category].append(r.rating)
-        
-        category_scores = {cat: np.mean(ratings) for cat, ratings in avg_ratings_by_category.items()}
-        
-        fallback_recommendations = []
-        for course in all_courses:
-            if course.id not in rated_course_ids:
-                score = category_scores.get(course.category, 3.0)
-                fallback_recommendations.append({
-                    'course_id': course.id,
-                    'predicted_rating': score,
-                    'title': course.title,
-                    'description': course.description,
-                    'category': course.category
-                })
-        
-        fallback_recommendations.sort(key=lambda x: x['predicted_rating'], reverse=True)
-        top_recommendations = fallback_recommendations[:10]
-        
-        explanations = {}
-        for rec in top_recommendations:
-            explanation = generate_explanation(user_id, rec['course_id'], session)
-            explanations[rec['course_id']] = explanation
-        
-        session.close()
-        return jsonify({
-            'recommendations': top_recommendations,
-            'explanations': explanations
-        })
+    model = ensure_model()
     
-    predictions = []
-    for course in all_courses:
-        if course.id not in rated_course_ids:
-            try:
-                pred = model_data.predict(user_id, course.id)
-                predictions.append({
-                    'course_id': course.id,
-                    'predicted_rating': pred,
-                    'title': course.title,
-                    'description': course.description,
-                    'category': course.category
-                })
-            except:
-                try:
-                    pred = model_data.global_mean
-                    predictions.append({
-                        'course_id': course.id,
-                        'predicted_rating': pred,
-                        'title': course.title,
-                        'description': course.description,
-                        'category': course.category
-                    })
-                except:
-                    pass
-    
-    predictions.sort(key=lambda x: x['predicted_rating'], reverse=True)
-    top_recommendations = predictions[:10]
+    cache_key = (
+        user_id,
+        model.version if model is not None else None,
+        catalog.etag,
+        fingerprint((sorted((r.course_id, r.rating) for r in user_ratings), profile))
+    )
+    # Identical requests in flight at the same time share one scoring and explanation pass
+    return jsonify(recommendation_flight.do(cache_key, build_recommendations, cache_key, user_id,
+                                            user_rated_courses, profile, catalog, model))
+
+def build_recommendations(cache_key, user_id, user_rated_courses, profile, catalog, model):
+    cached = recommendation_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
-    explanations = {}
-    for rec in top_recommendations:
-        course_id = rec['course_id']
-        explanation = generate_explanation(user_id, course_id, session)
-        explanations[course_id] = explanation
+    rated_course_ids = set(user_rated_courses)
+    weight = content_weight(len(user_rated_courses))
+    content = content_similarities(catalog, [profile], [weight])
+    if content is not None:
+        content = content.toarray()[0]
+    
+    if model is None:
+        scored = category_fallback(user_rated_courses, catalog.by_id, 10,
+                                   content=content, content_weight=weight)
+    elif 0 < len(user_rated_courses) <= COLD_START_MAX_RATINGS:
+        scored = model.recommend_similar(user_rated_courses, 10, course_ids=catalog.course_ids,
+                                         content=content, content_weight=weight)
+    elif uses_ann(model):
+        # Candidates come from the factor index, so the content score is not blended in
+        scored = model.recommend_approximate(user_id, 10, exclude=rated_course_ids,
+                                             course_ids=catalog.course_ids, n_probe=ANN_NPROBE)
+    else:
+        scored = model.recommend(user_id, 10, exclude=rated_course_ids,
+                                 course_ids=catalog.course_ids,
+                                 content=content, content_weight=weight)
+    
+    top_recommendations = [course_payload(catalog.by_id[course_id], pred)
+                           for course_id, pred in scored]
     
+    session = Session()
+    explanations = generate_explanations(
+        [rec['course_id'] for rec in top_recommendations],
+        user_rated_courses, catalog, session, model
+    )
     session.close()
     
-    return jsonify({
+    payload = {
         'recommendations': top_recommendations,
         'explanations': explanations
-    })
-
-def generate_explanation(user_id, course_id, session):
-    similar_users = session.query(Rating).filter(
-        Rating.course_id == course_id,
-        Rating.rating >= 4.0
-    ).limit(5).all()
-    
-    if similar_users:
-        user_ids = [r.user_id for r in similar_users]
-        user_ratings = session.query(Rating).filter(Rating.user_id == user_id).all()
-        user_rated_courses = {r.course_id: r.rating for r in user_ratings}
-        
-        similar_items = []
-        for similar_user_id in user_ids[:3]:
-            similar_user_ratings = session.query(Rating).filter(
-                Rating.user_id == similar_user_id
-            ).all()
-            common_courses = [r for r in similar_user_ratings if r.course_id in user_rated_courses]
-            if common_courses:
-                similar_items.append({
-                    'user_id': similar_user_id,
-                    'common_courses': len(common_courses)
-                })
-        
-        if similar_items:
-            return {
-                'type': 'similar_users',
-                'message': f"Users with similar preferences rated this course highly",
-                'count': len(similar_items)
-            }
-    
-    course = session.query(Course).filter(Course.id == course_id).first()
-    similar_courses = session.query(Course).filter(
-        Course.category == course.category,
-        Course.id != course_id
-    ).limit(3).all()
-    
-    if similar_courses:
-        return {
-            'type': 'similar_items',
-            'message': f"Similar courses in {course.category} category",
-            'count': len(similar_courses)
-        }
-    
-    return {
-        'type': 'general',
-        'message': 'Recommended based on your profile'
     }
+    recommendation_cache.set(cache_key, payload)
+    return payload
 
-@app.route('/api/metrics', methods=['GET'])
-def get_metrics():
+MAX_BATCH_USERS = int(os.environ.get('MAX_BATCH_USERS', 10000))
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 256))
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    enforce_rate_limit('recommendations')
+    data = request.json or {}
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        return jsonify({'error': 'user_ids must be a non-empty list'}), 400
+    if len(user_ids) > MAX_BATCH_USERS:
+        return jsonify({'error': f'At most {MAX_BATCH_USERS} users per batch'}), 400
+    try:
+        user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+        n = int(data.get('n', 10))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'user_ids and n must be integers'}), 400
+    stream = data.get('stream') or 'application/x-ndjson' in request.headers.get('Accept', '')
+    
+    catalog = course_catalog.get()
     session = Session()
-    ratings_data = session.query(Rating).all()
+    rated_rows = []
+    profiles = {}
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        rated_rows.extend(session.query(Rating.user_id, Rating.course_id, Rating.rating).filter(
+            Rating.user_id.in_(chunk)
+        ).all())
+        profiles.update((uid, profile_text(interests, skills)) for uid, interests, skills in
+                        session.query(User.id, User.interests, User.skills).filter(User.id.in_(chunk)))
     session.close()
     
-    if len(ratings_data) < 10:
-        return jsonify({'error': 'Not enough data for metrics'}), 400
+    courses_by_id = catalog.by_id
+    course_ids = catalog.course_ids
     
-    ratings_list = [(r.user_id, r.course_id, r.rating) for r in ratings_data]
-    df = pd.DataFrame(ratings_list, columns=['user_id', 'course_id', 'rating'])
+    model = ensure_model()
     
-    train_df, test_df = train_test_split(df, test_size=0.2, random_state=42)
+    rated_by_user = defaultdict(dict)
+    for uid, course_id, rating in rated_rows:
+        rated_by_user[uid][course_id] = rating
     
-    temp_model = train_model_from_dataframe(train_df)
+    weights = np.array([content_weight(len(rated_by_user[uid])) for uid in user_ids])
+    content = content_similarities(catalog, [profiles.get(uid, '') for uid in user_ids], weights)
     
-    if temp_model is None:
-        return jsonify({'error': 'Failed to train model'}), 400
+    def content_row(i):
+        return None if content is None else content[i].toarray()[0]
     
-    predictions = []
-    actuals = []
-    for _, row in test_df.iterrows():
-        try:
-            pred = temp_model.predict(row['user_id'], row['course_id'])
-            predictions.append(pred)
-            actuals.append(row['rating'])
-        except:
-            continue
-    
-    if len(predictions) == 0:
-        return jsonify({'error': 'No predictions generated'}), 400
+    if model is None:
+        scored_users = ((uid, category_fallback(rated_by_user[uid], courses_by_id, n,
+                                                content=content_row(i), content_weight=weights[i]))
+                        for i, uid in enumerate(user_ids))
+    else:
+        from scipy.sparse import csr_matrix
+        user_pos = {uid: i for i, uid in enumerate(user_ids)}
+        course_pos = {cid: i for i, cid in enumerate(course_ids)}
+        pairs = [(user_pos[uid], course_pos[cid]) for uid, cid, _ in rated_rows if cid in course_pos]
+        rows, cols = zip(*pairs) if pairs else ((), ())
+        exclude = csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                             shape=(len(user_ids), len(course_ids)))
+        scored_users = model.recommend_many(user_ids, n, exclude=exclude, course_ids=course_ids,
+                                            chunk_size=BATCH_CHUNK_SIZE,
+                                            content=content, content_weight=weights)
+    
+    def results():
+        for i, (uid, scored) in enumerate(scored_users):
+            if model is not None and 0 < len(rated_by_user[uid]) <= COLD_START_MAX_RATINGS:
+                scored = model.recommend_similar(rated_by_user[uid], n, course_ids=course_ids,
+                                                 content=content_row(i), content_weight=weights[i])
+            yield uid, [course_payload(courses_by_id[course_id], pred) for course_id, pred in scored]
+    
+    if stream:
+        def generate():
+            for uid, recommendations in results():
+                yield json.dumps({'user_id': uid, 'recommendations': recommendations}) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+    
+    return jsonify({'results': [
+        {'user_id': uid, 'recommendations': recommendations}
+        for uid, recommendations in results()
+    ]})
+
+@instrumented('generate_explanations')
+def generate_explanations(course_ids, rated_courses, catalog, session, model=None):
+    if not course_ids:
+        return {}
+    rated_course_ids = set(rated_courses)
+    liked_course_ids = [course_id for course_id, rating in rated_courses.items()
+                        if rating >= HIGH_RATING and course_id in catalog.by_id]
+    
+    # First five high raters of every course in one query; the window keeps the per-course limit in SQL
+    ranked = session.query(
+        Rating.user_id, Rating.course_id,
+        func.row_number().over(partition_by=Rating.course_id, order_by=Rating.id).label('rank')
+    ).filter(
+        Rating.course_id.in_(course_ids),
+        Rating.rating >= HIGH_RATING
+    ).subquery()
+    high_raters = defaultdict(list)
+    for rater_id, course_id in session.query(ranked.c.user_id, ranked.c.course_id).filter(
+        ranked.c.rank <= 5
+    ).order_by(ranked.c.course_id, ranked.c.rank):
+        high_raters[course_id].append(rater_id)
+    
+    candidate_raters = {rater_id for raters in high_raters.values() for rater_id in raters[:3]}
+    raters_with_common_courses = set()
+    if candidate_raters and rated_course_ids:
+        raters_with_common_courses = {row[0] for row in session.query(Rating.user_id).filter(
+            Rating.user_id.in_(candidate_raters),
+            Rating.course_id.in_(rated_course_ids)
+        ).distinct()}
     
-    rmse = np.sqrt(np.mean((np.array(predictions) - np.array(actuals)) ** 2))
-    top_k_precision = calculate_top_k_precision(temp_model, test_df, k=5)
+    explanations = {}
+    for course_id in course_ids:
+        liked_neighbors = model.similar_among(course_id, liked_course_ids) if model is not None else []
+        if liked_neighbors:
+            titles = ' and '.join(f'"{catalog.by_id[neighbor_id].title}"' for neighbor_id in liked_neighbors)
+            explanations[course_id] = {
+                'type': 'similar_items',
+                'message': f"Similar to {titles}, which you rated highly",
+                'count': len(liked_neighbors),
+                'course_ids': liked_neighbors
+            }
+            continue
+        
+        similar_count = sum(1 for rater_id in high_raters.get(course_id, [])[:3]
+                            if rater_id in raters_with_common_courses)
+        if similar_count:
+            explanations[course_id] = {
+                'type': 'similar_users',
+                'message': f"Users with similar preferences rated this course highly",
+                'count': similar_count
+            }
+            continue
+        
+        course = catalog.by_id[course_id]
+        similar_courses = min(3, len(catalog.by_category[course.category]) - 1)
+        if similar_courses > 0:
+            explanations[course_id] = {
+                'type': 'similar_items',
+                'message': f"Similar courses in {course.category} category",
+                'count': similar_courses
+            }
+        else:
+            explanations[course_id] = {
+                'type': 'general',
+                'message': 'Recommended based on your profile'
+            }
     
-    return jsonify({
-        'rmse': round(rmse, 4),
-        'top_k_precision': round(top_k_precision, 4)
-    })
+    return explanations
 
-def calculate_top_k_precision(model, test_df, k=5):
-    if model is None:
-        return 0.0
+METRICS_CV_FOLDS = int(os.environ.get('METRICS_CV_FOLDS', 0))
+METRICS_WORKERS = int(os.environ.get('METRICS_WORKERS', 1))
+METRICS_MAX_K = int(os.environ.get('METRICS_MAX_K', 50))
+METRICS_MAX_FOLDS = int(os.environ.get('METRICS_MAX_FOLDS', 10))
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    enforce_rate_limit('metrics')
+    k = request.args.get('k', 5, type=int)
+    folds = request.args.get('folds', METRICS_CV_FOLDS, type=int)
+    if not 1 <= k <= METRICS_MAX_K:
+        return jsonify({'error': f'k must be between 1 and {METRICS_MAX_K}'}), 400
+    if not 0 <= folds <= METRICS_MAX_FOLDS:
+        return jsonify({'error': f'folds must be between 0 and {METRICS_MAX_FOLDS}'}), 400
+    
+    model = current_model()
+    key = (model.version if model is not None else None, k, folds)
+    # Concurrent requests for the same evaluation wait for one run instead of each training folds
+    result, error = metrics_flight.do(key, evaluate_metrics, key if model is not None else None, k, folds)
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify(result)
+
+def evaluate_metrics(cache_key, k, folds):
+    cached = metrics_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return cached, None
     
-    user_predictions = defaultdict(list)
-    for _, row in test_df.iterrows():
-        try:
-            pred = model.predict(row['user_id'], row['course_id'])
-            user_predictions[row['user_id']].append((row['course_id'], pred, row['rating']))
-        except:
-            continue
+    df = ratings_frame()
+    if len(df) < 10:
+        return None, 'Not enough data for metrics'
     
-    precisions = []
-    for user_id, predictions_list in user_predictions.items():
-        predictions_list.sort(key=lambda x: x[1], reverse=True)
-        top_k = predictions_list[:k]
-        relevant = sum(1 for _, _, true_r in top_k if true_r >= 4.0)
-        if len(top_k) > 0:
-            precisions.append(relevant / min(k, len(top_k)))
+    if folds > 1:
+        metrics = cross_validate(trainer, df, folds=min(folds, len(df)), k=k, workers=METRICS_WORKERS)
+    else:
+        metrics = holdout(trainer, df, k=k)
     
-    return np.mean(precisions) if precisions else 0.0
+    if metrics is None:
+        return None, 'Failed to train model'
+    
+    result = {name: round(value, 4) if isinstance(value, float) else value
+              for name, value in metrics.items()}
+    result['k'] = k
+    if cache_key:
+        metrics_cache.set(cache_key, result)
+    return result, None
+
+def runtime_stats():
+    model = model_data
+    if model is not None:
+        yield ('recommender_model_info', 'gauge', 'Model currently served by this worker',
+               {'version': model.version or '', 'engine': trainer.name}, 1)
+        yield ('recommender_model_users', 'gauge', 'Users with a row in the served model', {},
+               len(model.user_ids))
+        yield ('recommender_model_courses', 'gauge', 'Courses with a row in the served model', {},
+               len(model.course_ids))
+        yield ('recommender_model_factors', 'gauge', 'Latent factors in the served model', {},
+               np.shape(model.user_factors)[1])
+        yield ('recommender_model_bytes', 'gauge', 'Size of the served model arrays', {},
+               model.nbytes)
+        yield ('recommender_model_folded_users', 'gauge', 'Users folded in since the last training run', {},
+               len(model._folded_users))
+    yield ('recommender_retrain_pending', 'gauge', 'Whether a background retrain is queued or running', {},
+           int(retrain_scheduler.pending))
+
+    cache_stats = recommendation_cache.stats()
+    for name in ('hits', 'shared_hits', 'misses', 'evictions'):
+        yield (f'recommender_recommendation_cache_{name}_total', 'counter',
+               f'Recommendation cache {name.replace("_", " ")}', {}, cache_stats[name])
+    yield ('recommender_recommendation_cache_entries', 'gauge', 'Recommendation responses cached in memory', {},
+           cache_stats['entries'])
+    yield ('recommender_recommendation_cache_hit_rate', 'gauge', 'Recommendation cache hits per lookup', {},
+           cache_stats['hit_rate'])
+    yield ('recommender_catalog_version', 'gauge', 'Version of the cached course catalog', {},
+           course_catalog.get().version)
+
+    for flight_name, flight in (('recommendations', recommendation_flight), ('metrics', metrics_flight),
+                                ('training', training_flight)):
+        flight_stats = flight.stats()
+        yield ('recommender_singleflight_executions_total', 'counter',
+               'Computations run by the first of a group of identical concurrent requests',
+               {'flight': flight_name}, flight_stats['executions'])
+        yield ('recommender_singleflight_shared_total', 'counter',
+               'Requests that waited for an identical in-flight computation instead of running their own',
+               {'flight': flight_name}, flight_stats['shared'])
+    for limiter_name, limiter in rate_limiters.items():
+        limiter_stats = limiter.stats()
+        yield ('recommender_rate_limit_allowed_total', 'counter', 'Requests let through by the rate limiter',
+               {'endpoint': limiter_name}, limiter_stats['allowed'])
+        yield ('recommender_rate_limit_limited_total', 'counter', 'Requests rejected with 429 by the rate limiter',
+               {'endpoint': limiter_name}, limiter_stats['limited'])
+        yield ('recommender_rate_limit_clients', 'gauge', 'Clients with a rate limit bucket in this worker',
+               {'endpoint': limiter_name}, limiter_stats['clients'])
+
+registry.add_callback(runtime_stats)
+
+INTERNAL_API_TOKEN = os.environ.get('INTERNAL_API_TOKEN')
+
+def require_internal_token():
+    # Production deploys keep runtime metrics and the profiler private until a token is configured
+    if not INTERNAL_API_TOKEN and os.environ.get('FLASK_ENV') == 'production':
+        abort(403)
+    if INTERNAL_API_TOKEN and request.headers.get('X-Internal-Token') != INTERNAL_API_TOKEN:
+        abort(403)
+
+@app.route('/api/internal/stats', methods=['GET'])
+def get_internal_stats():
+    require_internal_token()
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/internal/profile', methods=['GET', 'POST'])
+def internal_profile():
+    require_internal_token()
+    if request.method == 'POST':
+        data = request.json or {}
+        interval_ms = data.get('interval_ms', 10)
+        if isinstance(interval_ms, bool) or not isinstance(interval_ms, (int, float)) or not math.isfinite(interval_ms):
+            return jsonify({'error': 'interval_ms must be a number'}), 400
+        if data.get('reset'):
+            profiler.reset()
+        if data.get('enabled'):
+            profiler.start(max(interval_ms, 1) / 1000.0)
+        elif 'enabled' in data:
+            profiler.stop()
+        return jsonify({'running': profiler.running, 'samples': profiler.sample_count})
+    return Response(profiler.report(request.args.get('limit', 200, type=int)), mimetype='text/plain')
+
+_started = False
+
+def start_app():
+    # Entry point for servers (`gunicorn 'app:start_app()'`, asgi.py). Not a factory: it maps the published
+    # model, if there is one, once per process and returns the module's single app
+    global _started
+    if not _started:
+        _started = True
+        if model_data is None:
+            preloaded = model_store.load_current()
+            if preloaded is not None:
+                publish_model(preloaded)
+        if os.environ.get('PROFILER_ENABLED') == '1':
+            profiler.start()
+    return app
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
-    app.run(host='0.0.0.0', port=port, debug=debug)
+    init_db()
+    start_app().run(host='0.0.0.0', port=port, debug=debug)
 
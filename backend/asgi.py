@@ -0,0 +1,9 @@
+import os
+
+# Under an event loop, training would otherwise compete with request threads for the GIL
+os.environ.setdefault('TRAIN_IN_SUBPROCESS', '1')
+
+from app import start_app  # noqa: E402
+from asgi_adapter import WSGIAdapter  # noqa: E402
+
+app = WSGIAdapter(start_app())
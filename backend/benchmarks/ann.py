@@ -0,0 +1,101 @@
+import argparse
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import percentiles, timed, write_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from model import SVDModel  # noqa: E402
+
+
+def synthetic_model(n_courses, n_users, n_factors, n_topics, seed):
+    # Courses cluster around topics the way trained factors do; users mix a few topics
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(0, 1, (n_topics, n_factors))
+    course_topics = rng.integers(0, n_topics, n_courses)
+    course_factors = topics[course_topics] + rng.normal(0, 0.5, (n_courses, n_factors))
+    mixtures = rng.dirichlet(np.full(n_topics, 0.05), n_users)
+    user_factors = mixtures @ topics + rng.normal(0, 0.2, (n_users, n_factors))
+    scale = 1.0 / np.sqrt(n_factors)
+    return SVDModel(
+        np.arange(1, n_users + 1), np.arange(1, n_courses + 1),
+        np.full(n_users, 3.5), np.full(n_courses, 3.5),
+        user_factors * scale, course_factors * scale, 3.5, 'bench',
+        user_bias=rng.normal(0, 0.3, n_users), course_bias=rng.normal(0, 0.3, n_courses)
+    )
+
+
+def run_case(n_courses, n_users, n_factors, n_topics, n_queries, n, probes, seed):
+    model = synthetic_model(n_courses, n_users, n_factors, n_topics, seed)
+    course_ids = model.course_ids
+    _, build_seconds = timed(lambda: model.ann)
+    users = np.random.default_rng(seed + 1).choice(model.user_ids, n_queries, replace=False).tolist()
+
+    # Scores clip at 5.0, so a result counts as recalled when it scores at least as high as
+    # the exhaustive n-th result rather than only when it is the same course
+    cutoff, exact_latencies = {}, []
+    for user_id in users:
+        result, seconds = timed(model.recommend, user_id, n, None, course_ids)
+        cutoff[user_id] = result[-1][1]
+        exact_latencies.append(seconds)
+
+    modes = []
+    for n_probe in probes:
+        latencies, recalls = [], []
+        for user_id in users:
+            result, seconds = timed(model.recommend_approximate, user_id, n, None, course_ids, n_probe)
+            latencies.append(seconds)
+            recalls.append(sum(score >= cutoff[user_id] for _, score in result) / n)
+        mode = percentiles(latencies)
+        mode.update(n_probe=n_probe, recall_at_n=round(float(np.mean(recalls)), 4))
+        modes.append(mode)
+
+    return {
+        'courses': n_courses,
+        'n_factors': n_factors,
+        'n_lists': model.ann.n_lists,
+        'build_seconds': round(build_seconds, 3),
+        'exhaustive': percentiles(exact_latencies),
+        'ann': modes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare exhaustive and IVF (ANN) top-N retrieval')
+    parser.add_argument('--courses', type=int, nargs='+', default=[10000, 100000, 300000])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--factors', type=int, default=50)
+    parser.add_argument('--topics', type=int, default=200, help='clusters the synthetic courses are drawn around')
+    parser.add_argument('--queries', type=int, default=200, help='users timed per mode')
+    parser.add_argument('--n', type=int, default=10, help='recommendations per query')
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                        help='ANN_NPROBE values to sweep')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    cases = []
+    for n_courses in args.courses:
+        sys.stderr.write(f'Benchmarking {n_courses} courses...\n')
+        cases.append(run_case(n_courses, args.users, args.factors, args.topics, args.queries,
+                              args.n, args.probes, args.seed))
+
+    write_results({
+        'benchmark': 'ann',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cases': cases,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def percentiles(samples):
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    if len(samples) == 0:
+        return {}
+    return {
+        'count': int(len(samples)),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def synthetic_ratings(n_ratings, n_users, n_courses, n_factors=8, seed=0):
+    # Popularity-skewed unique (user, course) pairs with a low-rank rating signal
+    rng = np.random.default_rng(seed)
+    n_ratings = min(n_ratings, n_users * n_courses)
+    course_weights = 1.0 / np.arange(1, n_courses + 1) ** 0.8
+    course_weights /= course_weights.sum()
+
+    codes = np.empty(0, dtype=np.int64)
+    while len(codes) < n_ratings:
+        missing = n_ratings - len(codes)
+        users = rng.integers(0, n_users, 2 * missing)
+        courses = rng.choice(n_courses, 2 * missing, p=course_weights)
+        codes = np.unique(np.concatenate([codes, users.astype(np.int64) * n_courses + courses]))
+    codes = rng.permutation(codes)[:n_ratings]
+    users, courses = np.divmod(codes, n_courses)
+
+    user_factors = rng.normal(0, 1, (n_users, n_factors))
+    course_factors = rng.normal(0, 1, (n_courses, n_factors))
+    signal = np.einsum('ij,ij->i', user_factors[users], course_factors[courses]) / np.sqrt(n_factors)
+    ratings = np.clip(np.round(3.2 + signal + rng.normal(0, 0.5, n_ratings)), 1, 5)
+    return users, courses, ratings
+
+
+def write_results(results, output=None):
+    text = json.dumps(results, indent=2)
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
@@ -0,0 +1,141 @@
+import argparse
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.common import percentiles, synthetic_ratings, timed, write_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from model import PRECISIONS, SVDModel  # noqa: E402
+from trainers import get_trainer  # noqa: E402
+
+
+def with_precision(model, precision):
+    return SVDModel(
+        model.user_ids, model.course_ids, model.user_mean_ratings, model.course_mean_ratings,
+        model.user_factors, model.course_factors, model.global_mean, model.version,
+        user_bias=model.user_bias, course_bias=model.course_bias, precision=precision
+    )
+
+
+def dict_lookup_bytes(ids):
+    # What the id -> position dicts the model used to build cost for these ids
+    tracemalloc.start()
+    lookup = {uid: idx for idx, uid in enumerate(ids)}
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del lookup
+    return size
+
+
+def accuracy_case(n_ratings, n_users, n_courses, n_queries, n, engine, seed):
+    users, courses, ratings = synthetic_ratings(n_ratings, n_users, n_courses, seed=seed)
+    import pandas as pd
+    df = pd.DataFrame({'user_id': users + 1, 'course_id': courses + 1, 'rating': ratings})
+    test = np.random.default_rng(seed).random(len(df)) < 0.2
+    train_df, test_df = df[~test], df[test]
+    # Trained at full precision whatever MODEL_PRECISION says, so every variant is compacted from the same factors
+    reference = get_trainer(engine, precision='float64').train(train_df)
+
+    rng = np.random.default_rng(seed + 1)
+    sample = rng.choice(reference.user_ids, min(n_queries, len(reference.user_ids)), replace=False).tolist()
+    pairs_users = rng.choice(reference.user_ids, 2000).tolist()
+    pairs_courses = rng.choice(reference.course_ids, 2000).tolist()
+    expected_top = {u: [cid for cid, _ in reference.recommend(u, n)] for u in sample}
+    expected = reference.predict_many(test_df['user_id'].to_numpy(), test_df['course_id'].to_numpy())
+    actual = test_df['rating'].to_numpy()
+
+    variants = []
+    for precision in PRECISIONS:
+        model = with_precision(reference, precision)
+        predictions = model.predict_many(test_df['user_id'].to_numpy(), test_df['course_id'].to_numpy())
+        overlap = [len(set(expected_top[u]) & {cid for cid, _ in model.recommend(u, n)}) / n for u in sample]
+        predict_latencies = [timed(model.predict, u, c)[1] for u, c in zip(pairs_users, pairs_courses)]
+        recommend_latencies = [timed(model.recommend, u, n)[1] for u in sample]
+        variants.append({
+            'precision': precision,
+            'model_bytes': int(model.nbytes),
+            'holdout_rmse': round(float(np.sqrt(np.mean((predictions - actual) ** 2))), 5),
+            'max_abs_prediction_delta': float(np.abs(predictions - expected).max()),
+            'top_n_overlap': round(float(np.mean(overlap)), 4),
+            'predict': percentiles(predict_latencies),
+            'recommend': percentiles(recommend_latencies),
+        })
+
+    return {
+        'ratings': int(len(train_df)),
+        'users': int(len(reference.user_ids)),
+        'courses': int(len(reference.course_ids)),
+        'n_factors': int(np.shape(reference.user_factors)[1]),
+        'engine': engine,
+        'variants': variants,
+    }
+
+
+def memory_case(n_users, n_courses, n_factors, seed):
+    # Random factors at a scale too large to train here; only the footprint matters
+    rng = np.random.default_rng(seed)
+    reference = SVDModel(
+        np.arange(1, n_users + 1), np.arange(1, n_courses + 1),
+        np.full(n_users, 3.5), np.full(n_courses, 3.5),
+        rng.normal(0, 0.1, (n_users, n_factors)), rng.normal(0, 0.1, (n_courses, n_factors)), 3.5,
+        precision='float64'
+    )
+    sparse_ids = np.sort(rng.choice(10 * n_users, n_users, replace=False)) + 1
+    return {
+        'users': n_users,
+        'courses': n_courses,
+        'n_factors': n_factors,
+        'dict_lookup_bytes': dict_lookup_bytes(reference.user_ids) + dict_lookup_bytes(reference.course_ids),
+        'contiguous_ids_offset_lookup': reference.user_index.offset is not None,
+        'sparse_ids_offset_lookup': SVDModel(
+            sparse_ids, reference.course_ids, reference.user_mean_ratings, reference.course_mean_ratings,
+            reference.user_factors, reference.course_factors, 3.5, precision='float64'
+        ).user_index.offset is not None,
+        'model_bytes': {precision: int(with_precision(reference, precision).nbytes) for precision in PRECISIONS},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare model memory, accuracy and latency across MODEL_PRECISION values')
+    parser.add_argument('--ratings', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--courses', type=int, default=2000)
+    parser.add_argument('--engine', default='als', help='MODEL_ENGINE used to train the reference model')
+    parser.add_argument('--queries', type=int, default=200, help='users timed and compared per precision')
+    parser.add_argument('--n', type=int, default=10, help='recommendations per query')
+    parser.add_argument('--memory-users', type=int, nargs='+', default=[100000, 1000000],
+                        help='users in the untrained models used to measure footprint')
+    parser.add_argument('--memory-courses', type=int, default=10000)
+    parser.add_argument('--memory-factors', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    sys.stderr.write(f'Training on {args.ratings} ratings...\n')
+    accuracy = accuracy_case(args.ratings, args.users, args.courses, args.queries, args.n, args.engine, args.seed)
+    memory = []
+    for n_users in args.memory_users:
+        sys.stderr.write(f'Measuring a {n_users}-user model...\n')
+        memory.append(memory_case(n_users, args.memory_courses, args.memory_factors, args.seed))
+
+    write_results({
+        'benchmark': 'precision',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'accuracy': accuracy,
+        'memory': memory,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import percentiles, synthetic_ratings, timed, write_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATEGORIES = ['Data Science', 'Programming', 'Computer Science', 'Cybersecurity',
+              'Mobile Development', 'DevOps', 'UI/UX Design']
+
+
+def configure_backend(workdir):
+    # app.py configures itself from the environment at import time
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['MODEL_DIR'] = os.path.join(workdir, 'models')
+    os.environ['RETRAIN_DEBOUNCE_SECONDS'] = '3600'
+    os.environ['RETRAIN_MAX_STALENESS_SECONDS'] = '3600'
+    os.environ['RECOMMENDATION_CACHE_SIZE'] = '0'
+    os.environ.pop('RECOMMENDATION_CACHE_DIR', None)
+    os.environ['FOLD_IN_ENABLED'] = '0'
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+
+def load_backend(workdir):
+    configure_backend(workdir)
+    import app as backend
+    backend.init_db()
+    backend.start_app()
+    return backend
+
+
+def populate(backend, n_ratings, n_courses, density, seed):
+    n_users = max(2, math.ceil(n_ratings / (density * n_courses)))
+    users, courses, ratings = synthetic_ratings(n_ratings, n_users, n_courses, seed=seed)
+
+    with backend.engine.begin() as conn:
+        conn.execute(backend.User.__table__.insert(), [
+            {'name': f'Bench user {i}', 'interests': '', 'skills': '', 'time_per_week': 5}
+            for i in range(n_users)
+        ])
+        conn.execute(backend.Course.__table__.insert(), [
+            {'title': f'Bench course {i}', 'description': f'Synthetic course number {i}',
+             'category': CATEGORIES[i % len(CATEGORIES)]}
+            for i in range(n_courses)
+        ])
+        user_ids = np.array([row[0] for row in conn.execute(
+            backend.User.__table__.select().with_only_columns(backend.User.id).order_by(backend.User.id))])
+        course_ids = np.array([row[0] for row in conn.execute(
+            backend.Course.__table__.select().with_only_columns(backend.Course.id)
+            .where(backend.Course.title.like('Bench course %')).order_by(backend.Course.id))])
+
+        rating_table = backend.Rating.__table__
+        for start in range(0, len(ratings), 50000):
+            stop = start + 50000
+            conn.execute(rating_table.insert(), [
+                {'user_id': int(u), 'course_id': int(c), 'rating': float(r)}
+                for u, c, r in zip(user_ids[users[start:stop]], course_ids[courses[start:stop]],
+                                   ratings[start:stop])
+            ])
+
+    backend.course_catalog.invalidate()
+    return user_ids, n_users
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def measure_endpoint(client, counter, requests):
+    latencies = []
+    queries = []
+    for method, path, body in requests:
+        counter.count = 0
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - start)
+        queries.append(counter.count)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {path} returned {response.status_code}: {response.data[:200]}')
+    result = percentiles(latencies)
+    result['sql_queries_mean'] = round(float(np.mean(queries)), 2)
+    return result
+
+
+def run_case(n_ratings, n_courses, density, n_requests, batch_size, seed):
+    workdir = tempfile.mkdtemp(prefix='recommender-bench-')
+    try:
+        backend = load_backend(workdir)
+        (user_ids, n_users), populate_seconds = timed(populate, backend, n_ratings, n_courses, density, seed)
+        client = backend.app.test_client()
+        counter = QueryCounter(backend.engine)
+        rng = np.random.default_rng(seed)
+
+        counter.count = 0
+        model, train_seconds = timed(backend.train_model)
+        train_queries = counter.count
+
+        import pandas as pd
+        session = backend.Session()
+        rows = session.query(backend.Rating.user_id, backend.Rating.course_id, backend.Rating.rating).all()
+        session.close()
+        df = pd.DataFrame(rows, columns=['user_id', 'course_id', 'rating'])
+        _, fit_seconds = timed(backend.trainer.train, df)
+
+        sample_users = rng.choice(user_ids, min(n_requests, len(user_ids)), replace=False)
+        pairs_users = rng.choice(user_ids, 2000)
+        pairs_courses = rng.choice(model.course_ids, 2000)
+
+        predict_latencies = []
+        for u, c in zip(pairs_users.tolist(), pairs_courses.tolist()):
+            _, seconds = timed(model.predict, u, c)
+            predict_latencies.append(seconds)
+        _, predict_many_seconds = timed(model.predict_many, pairs_users, pairs_courses)
+        recommend_latencies = [timed(model.recommend, int(u), 10)[1] for u in sample_users]
+
+        catalog = backend.course_catalog.get()
+        session = backend.Session()
+        explanation_latencies = []
+        explanation_queries = []
+        for u in sample_users.tolist():
+            rated = dict(session.query(backend.Rating.course_id, backend.Rating.rating)
+                         .filter(backend.Rating.user_id == u))
+            recommended = [cid for cid, _ in model.recommend(u, 10, exclude=set(rated), course_ids=catalog.course_ids)]
+            counter.count = 0
+            _, seconds = timed(backend.generate_explanations, recommended, rated, catalog, session, model)
+            explanation_latencies.append(seconds)
+            explanation_queries.append(counter.count)
+        session.close()
+        explanations = percentiles(explanation_latencies)
+        explanations['sql_queries_mean'] = round(float(np.mean(explanation_queries)), 2)
+
+        batches = [('POST', '/api/recommendations/batch',
+                    {'user_ids': rng.choice(user_ids, min(batch_size, len(user_ids)), replace=False).tolist()})
+                   for _ in range(5)]
+
+        endpoints = {
+            'GET /api/courses': measure_endpoint(client, counter, [('GET', '/api/courses', None)] * 20),
+            'GET /api/recommendations/<id>': measure_endpoint(
+                client, counter, [('GET', f'/api/recommendations/{u}', None) for u in sample_users.tolist()]),
+            'GET /api/ratings/user/<id>': measure_endpoint(
+                client, counter, [('GET', f'/api/ratings/user/{u}', None) for u in sample_users.tolist()]),
+            'POST /api/recommendations/batch': measure_endpoint(client, counter, batches),
+            'GET /api/metrics (uncached)': measure_endpoint(client, counter, [('GET', '/api/metrics', None)]),
+            'GET /api/metrics (cached)': measure_endpoint(client, counter, [('GET', '/api/metrics', None)] * 20),
+        }
+        endpoints['POST /api/recommendations/batch']['users_per_batch'] = len(batches[0][2]['user_ids'])
+
+        return {
+            'ratings': int(len(df)),
+            'users': n_users,
+            'courses': int(len(catalog)),
+            'density': density,
+            'n_factors': int(np.shape(model.user_factors)[1]),
+            'engine': backend.trainer.name,
+            'populate_seconds': round(populate_seconds, 3),
+            'train_model_seconds': round(train_seconds, 3),
+            'train_model_sql_queries': train_queries,
+            'trainer_fit_seconds': round(fit_seconds, 3),
+            'model': {
+                'predict': percentiles(predict_latencies),
+                'predict_many_2000_pairs_ms': round(predict_many_seconds * 1000, 3),
+                'recommend': percentiles(recommend_latencies),
+            },
+            'generate_explanations': explanations,
+            'endpoints': endpoints,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark training and serving of the recommender backend')
+    parser.add_argument('--ratings', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='rating counts to benchmark, one isolated run per size')
+    parser.add_argument('--courses', type=int, default=500, help='synthetic courses added to the catalog')
+    parser.add_argument('--density', type=float, default=0.01,
+                        help='fraction of the user x course matrix that is rated; sets the user count')
+    parser.add_argument('--requests', type=int, default=200, help='single-user requests timed per endpoint')
+    parser.add_argument('--batch-size', type=int, default=500, help='users per batch recommendation request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--case', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        result = run_case(args.ratings[0], args.courses, args.density, args.requests, args.batch_size, args.seed)
+        sys.stdout.write(json.dumps(result) + '\n')
+        return
+
+    cases = []
+    for n_ratings in args.ratings:
+        # Each size runs in a fresh interpreter because app.py binds its database at import
+        command = [sys.executable, '-m', 'benchmarks.recommender', '--case', '--ratings', str(n_ratings),
+                   '--courses', str(args.courses), '--density', str(args.density),
+                   '--requests', str(args.requests), '--batch-size', str(args.batch_size),
+                   '--seed', str(args.seed)]
+        sys.stderr.write(f'Benchmarking {n_ratings} ratings...\n')
+        completed = subprocess.run(command, cwd=BACKEND_DIR, stdout=subprocess.PIPE, check=True, text=True)
+        cases.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    write_results({
+        'benchmark': 'recommender',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cases': cases,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import percentiles, timed, write_results
+from benchmarks.recommender import BACKEND_DIR, configure_backend, load_backend, populate
+
+HEAVY_MODULES = ('pandas', 'scipy.sparse', 'sklearn')
+
+
+def prepare(workdir, n_ratings, n_courses, density, seed):
+    # Seeds the database and publishes a model artifact for the timed runs to start from
+    backend = load_backend(workdir)
+    user_ids, _ = populate(backend, n_ratings, n_courses, density, seed)
+    session = backend.Session()
+    cold_user = backend.User(name='Bench cold user', interests='Python, Machine Learning',
+                             skills='SQL', time_per_week=5)
+    session.add(cold_user)
+    session.commit()
+    cold_user_id = cold_user.id
+    session.close()
+    backend.train_model()
+    return {'user_id': int(user_ids[0]), 'cold_user_id': cold_user_id}
+
+
+def run_case(workdir, model_dir, user_id, cold_user_id):
+    # One cold start: import, start_app, then the first request to each endpoint in order
+    configure_backend(workdir)
+    os.environ['MODEL_DIR'] = model_dir
+    started = time.perf_counter()
+    import app as backend
+    import_seconds = time.perf_counter() - started
+    _, start_app_seconds = timed(backend.start_app)
+    result = {
+        'import_seconds': import_seconds,
+        'start_app_seconds': start_app_seconds,
+        'model_preloaded': backend.model_data is not None,
+        'heavy_modules_after_startup': [name for name in HEAVY_MODULES if name in sys.modules],
+        'first_requests': {},
+    }
+    client = backend.app.test_client()
+    for name, path in [('GET /', '/'),
+                       ('GET /api/courses', '/api/courses'),
+                       ('GET /api/recommendations/<id>', f'/api/recommendations/{user_id}'),
+                       ('GET /api/recommendations/<id> (no ratings)', f'/api/recommendations/{cold_user_id}')]:
+        response, seconds = timed(client.get, path)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}')
+        result['first_requests'][name] = seconds
+    result['heavy_modules_after_requests'] = [name for name in HEAVY_MODULES if name in sys.modules]
+    return result
+
+
+def summarize(runs):
+    summary = {
+        'runs': len(runs),
+        'model_preloaded': runs[0]['model_preloaded'],
+        'heavy_modules_after_startup': runs[0]['heavy_modules_after_startup'],
+        'heavy_modules_after_requests': runs[0]['heavy_modules_after_requests'],
+        'import': percentiles([run['import_seconds'] for run in runs]),
+        'start_app': percentiles([run['start_app_seconds'] for run in runs]),
+        'first_requests': {name: percentiles([run['first_requests'][name] for run in runs])
+                           for name in runs[0]['first_requests']},
+    }
+    summary['ready_to_first_recommendation'] = percentiles([
+        run['import_seconds'] + run['start_app_seconds'] + sum(run['first_requests'].values()) for run in runs
+    ])
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time backend import, start_app and the first requests of a worker')
+    parser.add_argument('--ratings', type=int, default=100000)
+    parser.add_argument('--courses', type=int, default=500, help='synthetic courses added to the catalog')
+    parser.add_argument('--density', type=float, default=0.01,
+                        help='fraction of the user x course matrix that is rated; sets the user count')
+    parser.add_argument('--repeats', type=int, default=5, help='fresh interpreters started per mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--prepare', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--case', nargs=3, metavar=('MODEL_DIR', 'USER_ID', 'COLD_USER_ID'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.prepare:
+        result = prepare(args.workdir, args.ratings, args.courses, args.density, args.seed)
+        sys.stdout.write(json.dumps(result) + '\n')
+        return
+    if args.case:
+        model_dir, user_id, cold_user_id = args.case
+        result = run_case(args.workdir, model_dir, int(user_id), int(cold_user_id))
+        sys.stdout.write(json.dumps(result) + '\n')
+        return
+
+    def child(*extra):
+        # Every measurement needs a fresh interpreter: the point is what importing app.py costs
+        command = [sys.executable, '-m', 'benchmarks.startup', '--workdir', workdir, *extra]
+        completed = subprocess.run(command, cwd=BACKEND_DIR, stdout=subprocess.PIPE, check=True, text=True)
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    workdir = tempfile.mkdtemp(prefix='recommender-startup-')
+    try:
+        sys.stderr.write(f'Seeding {args.ratings} ratings and publishing a model...\n')
+        seeded = child('--prepare', '--ratings', str(args.ratings), '--courses', str(args.courses),
+                       '--density', str(args.density), '--seed', str(args.seed))
+        users = [str(seeded['user_id']), str(seeded['cold_user_id'])]
+
+        modes = {}
+        sys.stderr.write('Timing starts with a published model...\n')
+        modes['published_model'] = summarize([
+            child('--case', os.path.join(workdir, 'models'), *users) for _ in range(args.repeats)
+        ])
+        sys.stderr.write('Timing starts without a model artifact...\n')
+        modes['no_artifact'] = summarize([
+            child('--case', tempfile.mkdtemp(prefix='models-', dir=workdir), *users) for _ in range(args.repeats)
+        ])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    write_results({
+        'benchmark': 'startup',
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'ratings': args.ratings,
+        'modes': modes,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(values):
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()[:16]
+
+
+class DiskCacheBackend:
+    # One JSON file per response, shared by every worker on the host. Each worker sweeps the
+    # directory every `sweep_every` writes, deleting expired files and then the oldest past max_entries.
+    def __init__(self, directory, max_entries=10000, ttl=600.0, sweep_every=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sweep_every = sweep_every or max(1, max_entries // 10)
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.directory, str(user_id))
+
+    def _path(self, key):
+        user_id = key[0]
+        return os.path.join(self._user_dir(user_id), fingerprint(key[1:]) + '.json')
+
+    def get(self, key, ttl):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.sweep_every == 0
+        if due:
+            self.sweep()
+
+    def evict_user(self, user_id):
+        shutil.rmtree(self._user_dir(user_id), ignore_errors=True)
+
+    def sweep(self):
+        now = time.time()
+        entries = []
+        for user_dir in os.scandir(self.directory):
+            try:
+                files = list(os.scandir(user_dir.path))
+            except OSError:
+                continue
+            for entry in files:
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        expired = [path for mtime, path in entries if now - mtime > self.ttl]
+        # Fresh .tmp files are writes in progress in another worker
+        live = sorted(((mtime, path) for mtime, path in entries
+                       if now - mtime <= self.ttl and path.endswith('.json')), reverse=True)
+        removed = expired + [path for _, path in live[self.max_entries:]]
+        for path in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(removed)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+class RecommendationCache:
+    def __init__(self, max_entries=None, ttl=None, backend=None):
+        if max_entries is None:
+            max_entries = int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 1024))
+        if ttl is None:
+            ttl = float(os.environ.get('RECOMMENDATION_CACHE_TTL_SECONDS', 600))
+        if backend is None and os.environ.get('RECOMMENDATION_CACHE_DIR'):
+            backend = DiskCacheBackend(os.environ['RECOMMENDATION_CACHE_DIR'],
+                                       int(os.environ.get('RECOMMENDATION_CACHE_DIR_MAX_ENTRIES', 10000)), ttl)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = None
+        if self.backend is not None:
+            try:
+                value = self.backend.get(key, self.ttl)
+            except Exception:
+                logger.exception('Shared recommendation cache read failed')
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += 1
+            self._store(key, value, now)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value, time.monotonic())
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value)
+            except Exception:
+                logger.exception('Shared recommendation cache write failed')
+
+    def evict_user(self, user_id):
+        self.evict_users({user_id})
+
+    def evict_users(self, user_ids):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in user_ids]:
+                del self._entries[key]
+        if self.backend is not None:
+            for user_id in user_ids:
+                self.backend.evict_user(user_id)
+
+    def clear(self, shared=True):
+        with self._lock:
+            self._entries.clear()
+        if shared and self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _store(self, key, value, now):
+        self._entries[key] = (now, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from content import ContentIndex
+
+CatalogCourse = namedtuple('CatalogCourse', ['id', 'title', 'description', 'category'])
+
+
+class CatalogSnapshot:
+    def __init__(self, version, courses):
+        self.version = version
+        self.courses = tuple(courses)
+        self.by_id = {c.id: c for c in self.courses}
+        self.course_ids = list(self.by_id)
+        by_category = defaultdict(list)
+        for course in self.courses:
+            by_category[course.category].append(course.id)
+        self.by_category = dict(by_category)
+        self.json = json.dumps([c._asdict() for c in self.courses]).encode('utf-8')
+        self.etag = hashlib.sha1(self.json).hexdigest()
+        self._content = None
+        self._content_lock = threading.Lock()
+
+    @property
+    def content(self):
+        # Built on first use, once per catalog version
+        if self._content is None:
+            with self._content_lock:
+                if self._content is None:
+                    self._content = ContentIndex(self.courses)
+        return self._content
+
+    def __len__(self):
+        return len(self.courses)
+
+
+class CourseCatalog:
+    def __init__(self, loader, ttl=None):
+        if ttl is None:
+            ttl = float(os.environ.get('CATALOG_TTL_SECONDS', 300))
+        self.loader = loader
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._version = 0
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is not None and not self._expired():
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._expired():
+                self._reload()
+            return self._snapshot
+
+    def _expired(self):
+        return time.monotonic() - self._loaded_at >= self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def _reload(self):
+        courses = [CatalogCourse(*row) for row in self.loader()]
+        previous = self._snapshot
+        if previous is not None and previous.courses == tuple(courses):
+            self._loaded_at = time.monotonic()
+            return
+        self._version += 1
+        self._snapshot = CatalogSnapshot(self._version, courses)
+        self._loaded_at = time.monotonic()
@@ -0,0 +1,47 @@
+import numpy as np
+
+# Keeps tokens such as "c++" and "c#" that the default pattern splits apart
+TOKEN_PATTERN = r'(?u)\b\w[\w+#]*'
+
+
+def profile_text(interests, skills):
+    # Users store both as comma-separated lists
+    return ' '.join(part.strip() for field in (interests, skills) if field
+                    for part in field.split(',') if part.strip())
+
+
+class ContentIndex:
+    # L2-normalized TF-IDF rows over course text, in catalog order
+    def __init__(self, courses):
+        # sklearn costs about a second to import, so it waits until a catalog needs indexing
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        self.vectorizer = TfidfVectorizer(token_pattern=TOKEN_PATTERN, stop_words='english',
+                                          ngram_range=(1, 2), sublinear_tf=True, dtype=np.float32)
+        documents = [f'{c.title} {c.title} {c.category} {c.description or ""}' for c in courses]
+        try:
+            self.matrix = self.vectorizer.fit_transform(documents).tocsr()
+        except ValueError:
+            # No usable terms at all, e.g. an empty catalog
+            self.matrix = None
+
+    def similarities(self, texts):
+        # Cosine similarity of each text to every course as a sparse (len(texts), n_courses) matrix
+        if self.matrix is None:
+            return None
+        queries = self.vectorizer.transform(texts)
+        return (queries @ self.matrix.T).tocsr()
+
+
+def blend_content(scores, similarities, weight):
+    # Rescales each row's similarities so its best match reads as a 5 and its worst as a 1,
+    # then mixes them into the predicted ratings in place. Rows without any match are left alone.
+    similarities = np.atleast_2d(similarities)
+    scores_2d = scores.reshape(len(similarities), -1)
+    weight = np.broadcast_to(np.asarray(weight, dtype=np.float64), (len(similarities),))
+    best = similarities.max(axis=1)
+    rows = (best > 0) & (weight > 0)
+    if rows.any():
+        ratings = 1.0 + 4.0 * similarities[rows] / best[rows, None]
+        w = weight[rows, None]
+        scores_2d[rows] = (1.0 - w) * scores_2d[rows] + w * ratings
+    return scores
@@ -0,0 +1,102 @@
+import logging
+import os
+
+import numpy as np
+from sqlalchemy import create_engine, delete, event, func, inspect, select
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URL = 'sqlite:///recommendations.db'
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', '-20000'),
+)
+
+
+def database_url(url=None):
+    if url is None:
+        url = os.environ.get('DATABASE_URL', DEFAULT_URL)
+    # Render/Heroku hand out postgres:// URLs, which SQLAlchemy no longer accepts;
+    # pin the driver so the URL works with whichever default SQLAlchemy picks
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            url = 'postgresql+psycopg://' + url[len(scheme):]
+    return url
+
+
+def make_engine(url=None):
+    url = database_url(url)
+    if url.startswith('sqlite'):
+        busy_timeout = float(os.environ.get('SQLITE_BUSY_TIMEOUT_SECONDS', 30))
+        engine = create_engine(url, echo=False, connect_args={'timeout': busy_timeout})
+        if ':memory:' not in url and url not in ('sqlite://', 'sqlite:///'):
+            event.listen(engine, 'connect', _set_sqlite_pragmas)
+        return engine
+    return create_engine(
+        url,
+        echo=False,
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        pool_timeout=float(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 30)),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800)),
+        pool_pre_ping=True,
+    )
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def create_schema(engine, metadata):
+    # create_all skips indexes of tables that already exist, so add any that are missing
+    metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in metadata.sorted_tables:
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                _create_index(engine, table, index)
+
+
+def read_columns(connection, statement, dtypes, expected_rows=0, chunk_size=50000):
+    # Streams a select into one preallocated NumPy array per column. yield_per fetches
+    # chunk_size rows at a time (a server-side cursor on Postgres), so no more than one
+    # chunk of rows ever exists as Python objects.
+    columns = [np.empty(expected_rows, dtype=dtype) for dtype in dtypes]
+    count = 0
+    result = connection.execution_options(yield_per=chunk_size).execute(statement)
+    for rows in result.partitions():
+        stop = count + len(rows)
+        if stop > len(columns[0]):
+            # More rows than expected_rows, e.g. inserted after they were counted
+            columns = [np.resize(column, max(stop, 2 * len(column))) for column in columns]
+        for column, values in zip(columns, zip(*rows)):
+            column[count:stop] = values
+        count = stop
+    return [column[:count] for column in columns]
+
+
+def _create_index(engine, table, index):
+    logger.info('Creating index %s on %s', index.name, table.name)
+    try:
+        with engine.begin() as conn:
+            if index.unique:
+                # Older databases may hold duplicates; keep the most recent row of each
+                columns = [table.c[column.name] for column in index.columns]
+                latest = select(func.max(table.c.id)).group_by(*columns)
+                conn.execute(delete(table).where(table.c.id.not_in(latest)))
+            index.create(conn)
+    except DBAPIError:
+        # Another worker created it first
+        if not any(ix['name'] == index.name for ix in inspect(engine).get_indexes(table.name)):
+            raise
@@ -0,0 +1,101 @@
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def ranking_metrics(user_ids, predictions, actuals, k=5, threshold=4.0):
+    # Rank each user's test items by prediction; ties keep test-set order
+    user_ids = np.asarray(user_ids)
+    order = np.lexsort((np.arange(len(user_ids)), -predictions, user_ids))
+    users = user_ids[order]
+    relevant = np.asarray(actuals)[order] >= threshold
+
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    sizes = np.diff(np.r_[starts, len(users)])
+    group = np.repeat(np.arange(len(starts)), sizes)
+    rank = np.arange(len(users)) - starts[group]
+    in_top = rank < k
+
+    hits = np.bincount(group, weights=relevant & in_top, minlength=len(starts))
+    n_relevant = np.bincount(group, weights=relevant, minlength=len(starts))
+    precision = hits / np.minimum(k, sizes)
+
+    discounts = 1.0 / np.log2(np.arange(k) + 2)
+    dcg = np.bincount(group[in_top], weights=relevant[in_top] * discounts[rank[in_top]], minlength=len(starts))
+    ideal = np.r_[0.0, np.cumsum(discounts)][np.minimum(k, n_relevant).astype(int)]
+    has_relevant = n_relevant > 0
+
+    return {
+        'top_k_precision': float(precision.mean()) if len(precision) else 0.0,
+        'top_k_recall': float((hits[has_relevant] / n_relevant[has_relevant]).mean()) if has_relevant.any() else 0.0,
+        'top_k_ndcg': float((dcg[has_relevant] / ideal[has_relevant]).mean()) if has_relevant.any() else 0.0,
+    }
+
+
+def evaluate(model, test_df, k=5, threshold=4.0):
+    if model is None or len(test_df) == 0:
+        return None
+    user_ids = test_df['user_id'].to_numpy()
+    actuals = test_df['rating'].to_numpy(dtype=np.float64)
+    predictions = model.predict_many(user_ids, test_df['course_id'].to_numpy())
+    errors = predictions - actuals
+
+    metrics = {
+        'rmse': float(np.sqrt(np.mean(errors ** 2))),
+        'mae': float(np.mean(np.abs(errors))),
+    }
+    metrics.update(ranking_metrics(user_ids, predictions, actuals, k, threshold))
+    return metrics
+
+
+def _evaluate_split(args):
+    trainer, train_df, test_df, k = args
+    return evaluate(trainer.train(train_df), test_df, k)
+
+
+def holdout(trainer, df, k=5, test_size=0.2, seed=42):
+    from sklearn.model_selection import train_test_split
+    train_df, test_df = train_test_split(df, test_size=test_size, random_state=seed)
+    return _evaluate_split((trainer, train_df, test_df, k))
+
+
+def cross_validate(trainer, df, folds=5, k=5, seed=42, workers=1):
+    from sklearn.model_selection import KFold
+    splits = KFold(n_splits=folds, shuffle=True, random_state=seed).split(df)
+    tasks = [(trainer, df.iloc[train_idx], df.iloc[test_idx], k) for train_idx, test_idx in splits]
+    if workers > 1:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(_evaluate_split, tasks))
+    else:
+        results = [_evaluate_split(task) for task in tasks]
+
+    results = [r for r in results if r is not None]
+    if not results:
+        return None
+    summary = {name: float(np.mean([r[name] for r in results])) for name in results[0]}
+    summary['folds'] = len(results)
+    return summary
+
+
+class MetricsCache:
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
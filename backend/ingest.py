@@ -0,0 +1,226 @@
+import codecs
+import csv
+import json
+
+READ_SIZE = 64 * 1024
+REQUIRED_FIELDS = ('user_id', 'course_id', 'rating')
+JSON_WHITESPACE = ' \t\r\n'
+
+FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/jsonlines': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+class IngestError(ValueError):
+    # The body cannot be parsed any further; rows before it were already handled
+    def __init__(self, message, row=None):
+        super().__init__(message)
+        self.row = row
+
+
+def detect_format(mimetype, requested=None):
+    if requested:
+        return requested if requested in ('json', 'ndjson', 'csv') else None
+    return FORMATS.get(mimetype)
+
+
+def iter_records(stream, fmt):
+    # Yields (row_number, record, error); error is set for rows that could not be decoded
+    if fmt == 'json':
+        records = ((record, None) for record in iter_json_array(stream))
+    elif fmt == 'ndjson':
+        records = iter_ndjson(stream)
+    elif fmt == 'csv':
+        records = iter_csv(stream)
+    else:
+        raise IngestError(f'Unsupported format {fmt!r}')
+    for row, (record, error) in enumerate(records, 1):
+        yield row, record, error
+
+
+def iter_json_array(stream, read_size=READ_SIZE):
+    # Decodes one array element at a time so the body never has to fit in memory
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, eof = '', 0, False
+    count = 0
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(read_size)
+        eof = not chunk
+        try:
+            buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        except UnicodeDecodeError:
+            raise IngestError('Request body is not valid UTF-8', count + 1)
+        pos = 0
+
+    def next_char():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                return None
+            fill()
+
+    if next_char() != '[':
+        raise IngestError('Expected a JSON array of ratings')
+    pos += 1
+    if next_char() == ']':
+        return
+
+    while True:
+        if next_char() is None:
+            raise IngestError('Unexpected end of JSON array', count + 1)
+        while True:
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise IngestError(f'Malformed JSON: {e.msg}', count + 1)
+            # The element may continue in the next read
+            fill()
+        pos = end
+        count += 1
+        yield record
+
+        char = next_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise IngestError("Expected ',' or ']' after array element", count)
+        pos += 1
+
+
+def iter_ndjson(stream):
+    for line in _iter_lines(stream):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, f'Malformed JSON: {e}'
+
+
+def iter_csv(stream):
+    reader = csv.DictReader(_decode_lines(_iter_lines(stream)))
+    try:
+        missing = [field for field in REQUIRED_FIELDS if field not in (reader.fieldnames or ())]
+        if missing:
+            raise IngestError(f"CSV header is missing {', '.join(missing)}")
+        for record in reader:
+            yield record, None
+    except csv.Error as e:
+        raise IngestError(f'Malformed CSV: {e}', reader.line_num)
+
+
+def _iter_lines(stream, read_size=READ_SIZE):
+    pending = b''
+    while True:
+        chunk = stream.read(read_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+def _decode_lines(lines):
+    for number, line in enumerate(lines, 1):
+        try:
+            yield line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise IngestError('Request body is not valid UTF-8')
+
+
+def chunked(records, size):
+    chunk = []
+    for item in records:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_row(record):
+    if not isinstance(record, dict):
+        return None, 'Row must be an object with user_id, course_id and rating'
+    missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        return None, f"Missing {', '.join(missing)}"
+    try:
+        user_id = _as_int(record['user_id'])
+        course_id = _as_int(record['course_id'])
+        rating = float(record['rating'])
+    except (TypeError, ValueError):
+        return None, 'user_id and course_id must be integers and rating a number'
+    if not 1.0 <= rating <= 5.0:
+        return None, 'rating must be between 1 and 5'
+    return (user_id, course_id, rating), None
+
+
+def _as_int(value):
+    if isinstance(value, bool):
+        raise TypeError(value)
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    return int(value)
+
+
+def validate_chunk(chunk, existing_user_ids, course_ids):
+    # existing_user_ids(ids) returns the subset of ids that are stored users
+    parsed, errors = [], []
+    for row, record, error in chunk:
+        values = None
+        if error is None:
+            values, error = parse_row(record)
+        if error:
+            errors.append({'row': row, 'error': error})
+        else:
+            parsed.append((row, values))
+
+    known_users = existing_user_ids({values[0] for _, values in parsed}) if parsed else set()
+    ratings = {}
+    for row, (user_id, course_id, rating) in parsed:
+        if user_id not in known_users:
+            errors.append({'row': row, 'error': f'Unknown user_id {user_id}'})
+        elif course_id not in course_ids:
+            errors.append({'row': row, 'error': f'Unknown course_id {course_id}'})
+        else:
+            # A later row for the same pair wins, as it would in a later chunk
+            ratings[(user_id, course_id)] = rating
+
+    errors.sort(key=lambda e: e['row'])
+    rows = [{'user_id': user_id, 'course_id': course_id, 'rating': rating}
+            for (user_id, course_id), rating in ratings.items()]
+    return rows, errors
+
+
+def upsert_ratings(conn, table, rows):
+    # Relies on the unique (user_id, course_id) index on ratings
+    if not rows:
+        return
+    if conn.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif conn.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise IngestError(f'Bulk upserts are not supported on {conn.dialect.name}')
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'course_id'],
+                                      set_={'rating': stmt.excluded.rating})
+    conn.execute(stmt, rows)
@@ -0,0 +1,239 @@
+import functools
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter
+
+ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', '1') == '1'
+
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._callbacks = []
+
+    def _series(self, kind, name, help_text, labels, factory):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = {'kind': kind, 'help': help_text, 'series': {}}
+        key = tuple(sorted(labels.items()))
+        series = metric['series']
+        if key not in series:
+            series[key] = factory()
+        return series, key
+
+    def observe(self, name, value, help_text='', buckets=DURATION_BUCKETS, **labels):
+        with self._lock:
+            series, key = self._series('histogram', name, help_text, labels, lambda: Histogram(buckets))
+            series[key].observe(value)
+
+    def inc(self, name, value=1, help_text='', **labels):
+        with self._lock:
+            series, key = self._series('counter', name, help_text, labels, lambda: 0)
+            series[key] += value
+
+    def set(self, name, value, help_text='', **labels):
+        with self._lock:
+            series, key = self._series('gauge', name, help_text, labels, lambda: 0)
+            series[key] = value
+
+    def add_callback(self, fn):
+        # fn() yields (name, kind, help, labels, value) for values read at scrape time
+        self._callbacks.append(fn)
+
+    def render(self):
+        with self._lock:
+            metrics = {name: {'kind': m['kind'], 'help': m['help'],
+                              'series': {k: _snapshot(v) for k, v in m['series'].items()}}
+                       for name, m in self._metrics.items()}
+        for fn in self._callbacks:
+            for name, kind, help_text, labels, value in fn():
+                metric = metrics.setdefault(name, {'kind': kind, 'help': help_text, 'series': {}})
+                metric['series'][tuple(sorted(labels.items()))] = value
+
+        lines = []
+        for name in sorted(metrics):
+            metric = metrics[name]
+            if metric['help']:
+                lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for labels, value in sorted(metric['series'].items()):
+                if metric['kind'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                buckets, counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + [float('inf')], counts):
+                    cumulative += bucket_count
+                    le = ('le', _format_value(bound))
+                    lines.append(f'{name}_bucket{_format_labels(labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _snapshot(value):
+    if isinstance(value, Histogram):
+        return (value.buckets, list(value.counts), value.sum, value.count)
+    return value
+
+
+registry = Registry()
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS; unavailable on Windows
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def instrumented(name):
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                registry.observe('recommender_function_duration_seconds', time.perf_counter() - start,
+                                 'Time spent in instrumented functions', function=name)
+        return wrapper
+    return decorator
+
+
+_request_state = threading.local()
+
+
+def instrument_flask(app, engine):
+    if not ENABLED:
+        return
+
+    from flask import request
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_statement(*args):
+        registry.inc('recommender_sql_statements_total', help_text='SQL statements executed')
+        if getattr(_request_state, 'start', None) is not None:
+            _request_state.statements += 1
+
+    @app.before_request
+    def start_request_timer():
+        _request_state.start = time.perf_counter()
+        _request_state.statements = 0
+
+    @app.after_request
+    def record_request(response):
+        start = getattr(_request_state, 'start', None)
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        registry.observe('recommender_http_request_duration_seconds', time.perf_counter() - start,
+                         'Flask request handling time', method=request.method, route=route,
+                         status=str(response.status_code))
+        registry.observe('recommender_http_request_sql_statements', _request_state.statements,
+                         'SQL statements issued per request', buckets=COUNT_BUCKETS,
+                         method=request.method, route=route)
+        _request_state.start = None
+        return response
+
+
+class SamplingProfiler:
+    # Samples every thread's stack and aggregates them in collapsed (flamegraph) format
+    MIN_INTERVAL = 0.001
+
+    def __init__(self):
+        self.interval = 0.01
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Separate from _lock, which stop() holds while joining the sampling thread
+        self._samples_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        with self._lock:
+            if interval:
+                self.interval = max(interval, self.MIN_INTERVAL)
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._samples_lock:
+            self.samples = Counter()
+            self.sample_count = 0
+
+    def report(self, limit=200):
+        with self._samples_lock:
+            samples = Counter(self.samples)
+        return '\n'.join(f'{stack} {count}' for stack, count in samples.most_common(limit)) + '\n'
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = [';'.join(f'{entry.name} ({os.path.basename(entry.filename)})'
+                               for entry in traceback.extract_stack(frame))
+                      for thread_id, frame in sys._current_frames().items() if thread_id != own_id]
+            with self._samples_lock:
+                self.samples.update(stacks)
+                self.sample_count += 1
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,500 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from ann import IVFIndex
+from content import blend_content
+from instrumentation import instrumented
+from similarity import SimilarityIndex
+
+MODEL_FORMAT = 1
+MODEL_ARRAYS = ('user_ids', 'course_ids', 'user_mean_ratings', 'course_mean_ratings',
+                'user_factors', 'course_factors', 'user_bias', 'course_bias')
+SIMILARITY_ARRAYS = ('similar_courses', 'similar_scores')
+FACTOR_ARRAYS = ('user_factors', 'course_factors')
+
+PRECISIONS = ('float64', 'float32', 'int8')
+MODEL_PRECISION = os.environ.get('MODEL_PRECISION', 'float32')
+if MODEL_PRECISION not in PRECISIONS:
+    raise ValueError(f"Unknown MODEL_PRECISION '{MODEL_PRECISION}', expected one of {list(PRECISIONS)}")
+
+class IdIndex:
+    # Id -> row position without a Python dict. Ids come out of training sorted and unique,
+    # so a lookup is one searchsorted, or plain arithmetic when they form a contiguous range.
+    __slots__ = ('ids', 'offset')
+    
+    def __init__(self, ids):
+        self.ids = np.asarray(ids)
+        self.offset = None
+        n = len(self.ids)
+        if n and np.issubdtype(self.ids.dtype, np.integer) and int(self.ids[-1]) - int(self.ids[0]) == n - 1:
+            self.offset = int(self.ids[0])
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __contains__(self, item_id):
+        return self.get(item_id) is not None
+    
+    def get(self, item_id):
+        if self.offset is not None:
+            # Only whole ids map to a row; 5.0 finds id 5 as the dict lookup did, 5.5 finds nothing
+            try:
+                if not float(item_id).is_integer():
+                    return None
+            except (TypeError, ValueError):
+                return None
+            idx = int(item_id) - self.offset
+            return idx if 0 <= idx < len(self.ids) else None
+        idx = int(np.searchsorted(self.ids, item_id))
+        return idx if idx < len(self.ids) and self.ids[idx] == item_id else None
+    
+    def lookup(self, query):
+        # Positions of many ids at once, plus a mask of the ones that are present
+        if self.offset is None:
+            return lookup_ids(self.ids, query)
+        query = np.asarray(query)
+        whole = query.astype(np.int64)
+        idx = whole - self.offset
+        # Fractional ids are unknown, as in get(), rather than truncated onto a neighbouring id
+        known = (idx >= 0) & (idx < len(self.ids)) & (whole == query)
+        idx[~known] = 0
+        return idx, known
+
+class QuantizedFactors:
+    # int8 factor rows with one float32 scale per row. Indexing returns dequantized float32
+    # rows, so scoring code reads it like the dense matrix at a quarter of the float32 size.
+    __slots__ = ('values', 'scale')
+    
+    def __init__(self, values, scale):
+        self.values = values
+        self.scale = scale
+    
+    @classmethod
+    def quantize(cls, factors):
+        factors = np.asarray(factors, dtype=np.float32)
+        scale = np.abs(factors).max(axis=1, initial=0.0) / 127.0
+        values = np.divide(factors, scale[:, None], out=np.zeros_like(factors), where=scale[:, None] > 0)
+        return cls(np.round(values).astype(np.int8), scale.astype(np.float32))
+    
+    @property
+    def shape(self):
+        return self.values.shape
+    
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+    
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.scale.nbytes
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def __getitem__(self, idx):
+        return np.multiply(self.values[idx], np.expand_dims(self.scale[idx], -1), dtype=np.float32)
+    
+    def __array__(self, dtype=None, copy=None):
+        factors = self[:]
+        return factors if dtype is None else factors.astype(dtype, copy=False)
+
+def compact(array, precision, factors=False):
+    # float64 keeps arrays as trained; float32 halves them; int8 also quantizes the factor matrices
+    if precision == 'int8' and factors:
+        return array if isinstance(array, QuantizedFactors) else QuantizedFactors.quantize(array)
+    return np.asarray(array, dtype=np.float64 if precision == 'float64' else np.float32)
+
+class SVDModel:
+    __slots__ = ('user_ids', 'course_ids', 'user_mean_ratings', 'course_mean_ratings', 'user_factors',
+                 'course_factors', 'user_bias', 'course_bias', 'global_mean', 'version', 'precision',
+                 'user_index', 'course_index', '_folded_users', '_similarity', '_ann', '_index_lock')
+    
+    def __init__(self, user_ids, course_ids, user_mean_ratings, course_mean_ratings, 
+                 user_factors, course_factors, global_mean, version=None,
+                 user_bias=None, course_bias=None, similarity=None, precision=None):
+        if precision is None:
+            precision = MODEL_PRECISION
+        if user_bias is None:
+            user_bias = np.asarray(user_mean_ratings) - global_mean
+        if course_bias is None:
+            course_bias = np.asarray(course_mean_ratings) - global_mean
+        self.precision = precision
+        self.user_ids = np.asarray(user_ids)
+        self.course_ids = np.asarray(course_ids)
+        self.user_mean_ratings = compact(user_mean_ratings, precision)
+        self.course_mean_ratings = compact(course_mean_ratings, precision)
+        self.user_factors = compact(user_factors, precision, factors=True)
+        self.course_factors = compact(course_factors, precision, factors=True)
+        self.user_bias = compact(user_bias, precision)
+        self.course_bias = compact(course_bias, precision)
+        self.global_mean = float(global_mean)
+        self.version = version
+        self.user_index = IdIndex(self.user_ids)
+        self.course_index = IdIndex(self.course_ids)
+        # Users folded in since training: user_id -> (bias, factors), or None once removed
+        self._folded_users = {}
+        self._similarity = similarity
+        self._ann = None
+        self._index_lock = threading.Lock()
+    
+    @property
+    def similarity(self):
+        # Built on first use for artifacts saved without one
+        if self._similarity is None:
+            with self._index_lock:
+                if self._similarity is None:
+                    self._similarity = SimilarityIndex.build(self.course_factors)
+        return self._similarity
+    
+    @property
+    def ann(self):
+        if self._ann is None:
+            with self._index_lock:
+                if self._ann is None:
+                    self._ann = IVFIndex.build(self.course_factors, self.course_bias)
+        return self._ann
+    
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in MODEL_ARRAYS)
+    
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        arrays = {name: getattr(self, name) for name in MODEL_ARRAYS}
+        for name in FACTOR_ARRAYS:
+            if isinstance(arrays[name], QuantizedFactors):
+                arrays[f'{name}_scale'] = arrays[name].scale
+                arrays[name] = arrays[name].values
+        arrays['similar_courses'] = self.similarity.neighbors
+        arrays['similar_scores'] = self.similarity.scores
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f'{name}.npy'), np.asarray(array))
+        
+        manifest = {
+            'format': MODEL_FORMAT,
+            'version': self.version,
+            'precision': self.precision,
+            'global_mean': self.global_mean,
+            'n_users': len(self.user_ids),
+            'n_courses': len(self.course_ids),
+            'n_factors': int(np.shape(self.user_factors)[1]),
+            'arrays': {name: f'{name}.npy' for name in arrays}
+        }
+        # The manifest goes last so a readable manifest means a complete artifact
+        with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != MODEL_FORMAT:
+            raise ValueError(f"Unsupported model format {manifest.get('format')} in {directory}")
+        
+        arrays = {name: np.load(os.path.join(directory, filename), mmap_mode=mmap_mode)
+                  for name, filename in manifest['arrays'].items()}
+        similarity = None
+        if all(name in arrays for name in SIMILARITY_ARRAYS):
+            similarity = SimilarityIndex(arrays['similar_courses'], arrays['similar_scores'])
+        for name in FACTOR_ARRAYS:
+            if f'{name}_scale' in arrays:
+                arrays[name] = QuantizedFactors(arrays[name], arrays[f'{name}_scale'])
+        # Artifacts from before MODEL_PRECISION hold float64 arrays; either way they load as stored
+        return cls(
+            arrays['user_ids'], arrays['course_ids'],
+            arrays['user_mean_ratings'], arrays['course_mean_ratings'],
+            arrays['user_factors'], arrays['course_factors'],
+            manifest['global_mean'], manifest['version'],
+            user_bias=arrays['user_bias'], course_bias=arrays['course_bias'],
+            similarity=similarity, precision=manifest.get('precision', 'float64')
+        )
+    
+    @instrumented('svd_model_predict')
+    def predict(self, user_id, course_id):
+        course_idx = self.course_index.get(course_id)
+        if user_id in self._folded_users:
+            folded = self._folded_users[user_id]
+            if folded is None or course_idx is None:
+                return self.global_mean
+            user_bias, user_vector = folded
+        else:
+            user_idx = self.user_index.get(user_id)
+            if user_idx is None or course_idx is None:
+                return self.global_mean
+            user_bias = self.user_bias[user_idx]
+            user_vector = self.user_factors[user_idx]
+        
+        course_bias = self.course_bias[course_idx]
+        interaction = np.dot(user_vector, self.course_factors[course_idx])
+        
+        prediction = self.global_mean + user_bias + course_bias + interaction
+        prediction = max(1.0, min(5.0, float(prediction)))
+        
+        return prediction
+    
+    def predict_many(self, user_ids, course_ids):
+        user_bias, user_vectors, user_known = self._user_rows(user_ids)
+        course_idx, course_known = self.course_index.lookup(course_ids)
+        known = user_known & course_known
+        
+        predictions = np.full(len(known), self.global_mean, dtype=np.float64)
+        c = course_idx[known]
+        interaction = np.einsum('ij,ij->i', user_vectors[known], self.course_factors[c])
+        predictions[known] = self.global_mean + user_bias[known] + self.course_bias[c] + interaction
+        return np.clip(predictions, 1.0, 5.0)
+    
+    def score_matrix(self, user_ids, course_ids=None):
+        if course_ids is None:
+            course_ids = self.course_ids
+            course_idx = np.arange(len(course_ids))
+            course_known = np.ones(len(course_ids), dtype=bool)
+        else:
+            course_ids = np.asarray(course_ids)
+            course_idx, course_known = self.course_index.lookup(course_ids)
+        user_bias, user_vectors, user_known = self._user_rows(user_ids)
+        
+        scores = np.full((len(user_known), len(course_ids)), self.global_mean, dtype=np.float64)
+        if user_known.any() and course_known.any():
+            c = course_idx[course_known]
+            block = user_vectors[user_known] @ self.course_factors[c].T
+            block += (self.global_mean + user_bias[user_known])[:, None]
+            block += self.course_bias[c]
+            scores[np.ix_(user_known, course_known)] = block
+        np.clip(scores, 1.0, 5.0, out=scores)
+        return course_ids, scores
+    
+    def score_courses(self, user_id, course_ids=None):
+        course_ids, scores = self.score_matrix([user_id], course_ids)
+        return course_ids, scores[0]
+    
+    @instrumented('svd_model_recommend')
+    def recommend(self, user_id, n=10, exclude=None, course_ids=None, content=None, content_weight=0.0):
+        # content: optional content similarity to each of course_ids, blended in with content_weight
+        ids, scores = self.score_courses(user_id, course_ids)
+        if content is not None:
+            blend_content(scores, content, content_weight)
+        if exclude:
+            scores = scores.copy()
+            scores[np.isin(ids, np.fromiter(exclude, dtype=ids.dtype))] = -np.inf
+        
+        top = top_n_indices(scores, n)
+        return [(ids[i].item(), float(scores[i])) for i in top]
+    
+    @instrumented('svd_model_recommend_approximate')
+    def recommend_approximate(self, user_id, n=10, exclude=None, course_ids=None, n_probe=16):
+        # Candidates from the closest IVF partitions, re-ranked with the exact model score.
+        # course_ids must be sorted (the catalog is); courses the model has never seen
+        # have no factors to retrieve them by and are left out.
+        _, vectors, known = self._user_rows([user_id])
+        if not known[0]:
+            return self.recommend(user_id, n, exclude, course_ids)
+        
+        excluded = np.fromiter(exclude, dtype=np.int64) if exclude else np.empty(0, dtype=np.int64)
+        candidates = self.ann.search(vectors[0], n_probe, min_candidates=n + len(excluded))
+        ids = self.course_ids[np.sort(candidates)]
+        if course_ids is not None:
+            ids = ids[lookup_ids(np.asarray(course_ids), ids)[1]]
+        ids = ids[~np.isin(ids, excluded)]
+        
+        _, scores = self.score_courses(user_id, ids)
+        top = top_n_indices(scores, n)
+        return [(ids[i].item(), float(scores[i])) for i in top]
+    
+    def recommend_many(self, user_ids, n=10, exclude=None, course_ids=None, chunk_size=256,
+                       content=None, content_weight=0.0):
+        # exclude is a sparse (len(user_ids), len(course_ids)) mask of items to skip; content is
+        # an optional sparse matrix of the same shape, blended in with per-user content_weight
+        user_ids = list(user_ids)
+        weights = np.broadcast_to(np.asarray(content_weight, dtype=np.float64), (len(user_ids),))
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            ids, scores = self.score_matrix(chunk, course_ids)
+            if content is not None:
+                stop = start + len(chunk)
+                blend_content(scores, content[start:stop].toarray(), weights[start:stop])
+            if exclude is not None:
+                rows, cols = exclude[start:start + len(chunk)].nonzero()
+                scores[rows, cols] = -np.inf
+            for row, user_id in enumerate(chunk):
+                top = top_n_indices(scores[row], n)
+                yield user_id, [(ids[i].item(), float(scores[row, i])) for i in top]
+    
+    def recommend_similar(self, rated, n=10, course_ids=None, shrinkage=1.0, content=None, content_weight=0.0):
+        # Item-based scores for users with too few ratings to place in factor space:
+        # each course's baseline, nudged by how its neighbors were rated against theirs
+        if course_ids is None:
+            course_ids = self.course_ids
+            course_idx = np.arange(len(course_ids))
+            course_known = np.ones(len(course_ids), dtype=bool)
+        else:
+            course_ids = np.asarray(course_ids)
+            course_idx, course_known = self.course_index.lookup(course_ids)
+        
+        baseline = self.global_mean + np.asarray(self.course_bias, dtype=np.float64)
+        rated_ids = np.fromiter(rated, dtype=np.int64, count=len(rated))
+        ratings = np.fromiter(rated.values(), dtype=np.float64, count=len(rated))
+        rated_idx, rated_known = self.course_index.lookup(rated_ids)
+        r = rated_idx[rated_known]
+        adjustment = self.similarity.adjustments(r, ratings[rated_known] - baseline[r], shrinkage)
+        
+        scores = np.full(len(course_ids), self.global_mean, dtype=np.float64)
+        c = course_idx[course_known]
+        scores[course_known] = baseline[c] + adjustment[c]
+        np.clip(scores, 1.0, 5.0, out=scores)
+        if content is not None:
+            blend_content(scores, content, content_weight)
+        scores[np.isin(course_ids, rated_ids)] = -np.inf
+        
+        top = top_n_indices(scores, n)
+        return [(course_ids[i].item(), float(scores[i])) for i in top]
+    
+    def similar_among(self, course_id, candidate_ids, limit=2):
+        # The candidates that are nearest neighbors of course_id, most similar first
+        course_idx = self.course_index.get(course_id)
+        if course_idx is None or not candidate_ids:
+            return []
+        candidate_idx, known = self.course_index.lookup(np.fromiter(candidate_ids, dtype=np.int64))
+        neighbors, _ = self.similarity.related(course_idx, candidate_idx[known])
+        return [self.course_ids[i].item() for i in neighbors[:limit]]
+    
+    def fold_in(self, user_id, course_ids, ratings, reg=0.1, sgd_epochs=0, learning_rate=0.01):
+        # Ridge fit of [b_u, p_u] against the fixed course biases and factors, the same
+        # r_ui ~ mu + b_u + b_i + p_u . q_i that scoring uses
+        ratings = np.asarray(ratings, dtype=np.float64)
+        if len(ratings) == 0:
+            self._folded_users[user_id] = None
+            return
+        
+        n_factors = np.shape(self.course_factors)[1]
+        course_idx, known = self.course_index.lookup(course_ids)
+        c = course_idx[known]
+        q = np.asarray(self.course_factors[c], dtype=np.float64)
+        course_bias = np.asarray(self.course_bias[c], dtype=np.float64)
+        observed = ratings[known]
+        
+        if len(observed):
+            features = np.column_stack([np.ones(len(observed)), q])
+            solution = np.linalg.solve(features.T @ features + reg * np.eye(n_factors + 1),
+                                       features.T @ (observed - self.global_mean - course_bias))
+            user_bias, user_vector = solution[0], solution[1:]
+        else:
+            user_bias = ratings.mean() - self.global_mean
+            user_vector = np.zeros(n_factors)
+        
+        rng = np.random.default_rng()
+        for _ in range(sgd_epochs):
+            for j in rng.permutation(len(observed)):
+                error = observed[j] - (self.global_mean + user_bias + course_bias[j] + user_vector @ q[j])
+                user_bias += learning_rate * (error - reg * user_bias)
+                user_vector += learning_rate * (error * q[j] - reg * user_vector)
+        
+        self._folded_users[user_id] = (user_bias, user_vector)
+    
+    def _user_rows(self, user_ids):
+        user_ids = np.asarray(user_ids)
+        user_idx, known = self.user_index.lookup(user_ids)
+        n_factors = np.shape(self.user_factors)[1]
+        bias = np.zeros(len(user_ids), dtype=np.float64)
+        vectors = np.zeros((len(user_ids), n_factors), dtype=self.user_factors.dtype)
+        bias[known] = self.user_bias[user_idx[known]]
+        vectors[known] = self.user_factors[user_idx[known]]
+        
+        folded = self._folded_users
+        if folded:
+            folded_ids = np.fromiter(list(folded), dtype=np.int64, count=len(folded))
+            for pos in np.flatnonzero(np.isin(user_ids, folded_ids)):
+                entry = folded.get(user_ids[pos].item())
+                if entry is None:
+                    known[pos] = False
+                else:
+                    bias[pos], vectors[pos] = entry
+                    known[pos] = True
+        return bias, vectors, known
+
+def lookup_ids(sorted_ids, query):
+    query = np.asarray(query)
+    if len(sorted_ids) == 0:
+        return np.zeros(len(query), dtype=np.intp), np.zeros(len(query), dtype=bool)
+    idx = np.searchsorted(sorted_ids, query)
+    idx[idx == len(sorted_ids)] = 0
+    return idx, sorted_ids[idx] == query
+
+def top_n_indices(scores, n):
+    # Highest scores first; ties keep their original order like a stable sort would
+    finite = np.flatnonzero(np.isfinite(scores))
+    if n <= 0 or len(finite) == 0:
+        return np.array([], dtype=np.intp)
+    if n < len(finite):
+        candidates = finite[np.argpartition(-scores[finite], n - 1)[:n]]
+        threshold = scores[candidates].min()
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:n - len(above)]
+        finite = np.concatenate([above, ties])
+    return finite[np.lexsort((finite, -scores[finite]))]
+
+def data_version(df, salt='', precision=None):
+    # Models trained the same way on the same ratings share a version across workers
+    data = np.column_stack([df['user_id'].to_numpy(), df['course_id'].to_numpy(), df['rating'].to_numpy()])
+    digest = hashlib.sha1(f'{salt}:{precision or MODEL_PRECISION}'.encode('utf-8'))
+    digest.update(np.ascontiguousarray(data, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+@instrumented('train_model_from_dataframe')
+def train_model_from_dataframe(df, max_factors=50, precision=None):
+    if len(df) < 3:
+        return None
+    # Only training needs scipy's sparse solvers; serving a loaded model does not
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.linalg import svds
+    
+    user_ids, user_codes = np.unique(df['user_id'].to_numpy(), return_inverse=True)
+    course_ids, course_codes = np.unique(df['course_id'].to_numpy(), return_inverse=True)
+    ratings = df['rating'].to_numpy(dtype=np.float64)
+    
+    n_users = len(user_ids)
+    n_courses = len(course_ids)
+    
+    global_mean = ratings.mean()
+    user_means = (np.bincount(user_codes, weights=ratings, minlength=n_users) /
+                  np.bincount(user_codes, minlength=n_users))
+    course_means = (np.bincount(course_codes, weights=ratings, minlength=n_courses) /
+                    np.bincount(course_codes, minlength=n_courses))
+    
+    # Keep the last rating for a repeated (user, course) pair instead of summing them
+    pair_codes = user_codes.astype(np.int64) * n_courses + course_codes
+    _, last_from_end = np.unique(pair_codes[::-1], return_index=True)
+    keep = len(pair_codes) - 1 - last_from_end
+    rows = user_codes[keep]
+    cols = course_codes[keep]
+    centered = ratings[keep] - user_means[rows]
+    normalized_matrix = csr_matrix((centered, (rows, cols)), shape=(n_users, n_courses))
+    
+    n_factors = min(max_factors, min(n_users, n_courses) - 1)
+    if n_factors < 1:
+        n_factors = 1
+    
+    if n_users == 1 or np.count_nonzero(centered) < 5:
+        user_factors = np.zeros((n_users, n_factors))
+        course_factors = np.zeros((n_courses, n_factors))
+    else:
+        try:
+            k = min(n_factors, min(n_users, n_courses) - 1)
+            if k < 1:
+                k = 1
+            U, sigma, Vt = svds(normalized_matrix, k=k)
+            sqrt_sigma = np.sqrt(sigma)
+            user_factors = U * sqrt_sigma
+            course_factors = Vt.T * sqrt_sigma
+        except:
+            user_factors = np.zeros((n_users, n_factors))
+            course_factors = np.zeros((n_courses, n_factors))
+    
+    return SVDModel(
+        user_ids, course_ids, user_means, course_means,
+        user_factors, course_factors, global_mean, data_version(df, f'svd:{max_factors}', precision),
+        precision=precision
+    )
@@ -0,0 +1,113 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from model import SVDModel
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStore:
+    def __init__(self, directory=None, keep=None, reload_interval=None):
+        if directory is None:
+            directory = os.environ.get('MODEL_DIR', 'models')
+        if keep is None:
+            keep = int(os.environ.get('MODEL_KEEP_VERSIONS', 3))
+        if reload_interval is None:
+            reload_interval = float(os.environ.get('MODEL_RELOAD_INTERVAL_SECONDS', 5.0))
+        self.directory = directory
+        self.keep = max(keep, 1)
+        self.reload_interval = reload_interval
+        self.loaded_version = None
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def load(self, version):
+        model = SVDModel.load(os.path.join(self.directory, version))
+        self.loaded_version = version
+        return model
+
+    def load_current(self):
+        version = self.current_version()
+        if version is None:
+            return None
+        try:
+            return self.load(version)
+        except (OSError, ValueError, KeyError):
+            logger.exception('Could not load model artifact %s', version)
+            return None
+
+    def poll(self):
+        # Returns a newer published model, or None when the loaded one is current
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return None
+        with self._lock:
+            if now - self._last_check < self.reload_interval:
+                return None
+            self._last_check = now
+            version = self.current_version()
+            if version is None or version == self.loaded_version:
+                return None
+            return self.load_current()
+
+    def publish(self, model):
+        with self._lock:
+            version = model.version or uuid.uuid4().hex[:16]
+            model.version = version
+            target = os.path.join(self.directory, version)
+            if not os.path.exists(os.path.join(target, 'manifest.json')):
+                shutil.rmtree(target, ignore_errors=True)
+                staging = os.path.join(self.directory, f'.{version}.{uuid.uuid4().hex[:8]}')
+                model.save(staging)
+                try:
+                    os.replace(staging, target)
+                except OSError:
+                    # Another worker published the same version first
+                    shutil.rmtree(staging, ignore_errors=True)
+            os.utime(target)
+            self._write_current(version)
+            self._prune(version)
+            self._last_check = time.monotonic()
+            return self.load(version)
+
+    def _write_current(self, version):
+        tmp_path = os.path.join(self.directory, f'.CURRENT.{uuid.uuid4().hex[:8]}')
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(self.directory, 'CURRENT'))
+
+    def _prune(self, current):
+        versions = [name for name in os.listdir(self.directory)
+                    if not name.startswith('.') and os.path.isdir(os.path.join(self.directory, name))]
+        versions.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)), reverse=True)
+        for name in versions[self.keep:]:
+            if name != current:
+                # Workers that still map the old files keep them until they reload
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+def train_and_publish(trainer, df, directory, previous_version=None):
+    # Entry point of the training subprocess: the serving process only maps the published artifact
+    store = ModelStore(directory)
+    previous = None
+    if previous_version is not None:
+        try:
+            previous = store.load(previous_version)
+        except (OSError, ValueError, KeyError):
+            previous = None
+    model = trainer.train(df, previous=previous)
+    if model is None:
+        return None
+    store.publish(model)
+    return model.version
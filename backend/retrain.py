@@ -0,0 +1,72 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RetrainScheduler:
+    def __init__(self, train_fn, debounce=None, max_staleness=None):
+        if debounce is None:
+            debounce = float(os.environ.get('RETRAIN_DEBOUNCE_SECONDS', 2.0))
+        if max_staleness is None:
+            max_staleness = float(os.environ.get('RETRAIN_MAX_STALENESS_SECONDS', 30.0))
+        self.train_fn = train_fn
+        self.debounce = debounce
+        self.max_staleness = max(max_staleness, debounce)
+        self._cond = threading.Condition()
+        self._dirty_since = None
+        self._last_change = None
+        self._running = False
+        self._thread = None
+        self._pid = None
+
+    @property
+    def pending(self):
+        with self._cond:
+            return self._dirty_since is not None or self._running
+
+    def mark_dirty(self):
+        now = time.monotonic()
+        with self._cond:
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._last_change = now
+            self._ensure_worker()
+            self._cond.notify_all()
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._running = False
+        self._thread = threading.Thread(target=self._run, name='retrain-scheduler', daemon=True)
+        self._thread.start()
+
+    def _next_deadline(self):
+        return min(self._last_change + self.debounce, self._dirty_since + self.max_staleness)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._dirty_since is None:
+                    self._cond.wait()
+                while True:
+                    remaining = self._next_deadline() - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._dirty_since = None
+                self._last_change = None
+                self._running = True
+
+            try:
+                self.train_fn()
+            except Exception:
+                logger.exception('Background model retrain failed')
+            finally:
+                with self._cond:
+                    self._running = False
+                    self._cond.notify_all()
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+NEIGHBORS = int(os.environ.get('SIMILARITY_NEIGHBORS', 20))
+
+
+class SimilarityIndex:
+    # Top-K cosine neighbors of each course over the model's course factors.
+    # neighbors[i] holds course positions (model order) sorted by similarity, padded with -1.
+    def __init__(self, neighbors, scores):
+        self.neighbors = neighbors
+        self.scores = scores
+
+    @classmethod
+    def build(cls, course_factors, k=NEIGHBORS, block_size=1024):
+        factors = np.asarray(course_factors, dtype=np.float32)
+        n_courses = len(factors)
+        k = max(0, min(k, n_courses - 1))
+        neighbors = np.full((n_courses, k), -1, dtype=np.int32)
+        scores = np.zeros((n_courses, k), dtype=np.float32)
+        if k == 0:
+            return cls(neighbors, scores)
+
+        norms = np.linalg.norm(factors, axis=1, keepdims=True)
+        unit = np.divide(factors, norms, out=np.zeros_like(factors), where=norms > 0)
+        for start in range(0, n_courses, block_size):
+            stop = min(start + block_size, n_courses)
+            sims = unit[start:stop] @ unit.T
+            sims[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            # Courses pointing away from each other are not neighbors
+            similar = top_scores > 0
+            neighbors[start:stop] = np.where(similar, top, -1)
+            scores[start:stop] = np.where(similar, top_scores, 0.0)
+        return cls(neighbors, scores)
+
+    def related(self, idx, candidates):
+        # Candidates among the neighbors of course idx, most similar first
+        row = np.asarray(self.neighbors[idx])
+        hits = np.isin(row, candidates) & (row >= 0)
+        return row[hits], np.asarray(self.scores[idx])[hits]
+
+    def adjustments(self, rated_idx, deviations, shrinkage=1.0):
+        # Similarity-weighted average of rating deviations, spread to the neighbors of each rated course
+        n_courses = len(self.neighbors)
+        numerator = np.zeros(n_courses)
+        weight = np.zeros(n_courses)
+        neighbors = np.asarray(self.neighbors[rated_idx])
+        sims = np.asarray(self.scores[rated_idx], dtype=np.float64)
+        valid = neighbors >= 0
+        np.add.at(numerator, neighbors[valid], (sims * np.asarray(deviations)[:, None])[valid])
+        np.add.at(weight, neighbors[valid], sims[valid])
+        return numerator / (weight + shrinkage)
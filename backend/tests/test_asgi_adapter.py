@@ -0,0 +1,83 @@
+import asyncio
+
+from asgi_adapter import WSGIAdapter
+
+
+def http_scope(headers=(), method='GET', path='/'):
+    return {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'http_version': '1.1',
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]}
+
+
+def run(adapter, scope, messages):
+    # Drives one ASGI call, feeding `messages` to receive() and returning what was sent
+    sent = []
+
+    async def call():
+        incoming = list(messages)
+
+        async def receive():
+            return incoming.pop(0) if incoming else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await adapter(scope, receive, send)
+
+    asyncio.run(call())
+    return sent
+
+
+def body_of(sent):
+    return b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+
+
+def test_request_body_and_streamed_response():
+    def app(environ, start_response):
+        data = environ['wsgi.input'].read()
+        start_response('201 Created', [('Content-Type', 'text/plain')])
+        return [b'got ', data]
+
+    sent = run(WSGIAdapter(app, threads=1), http_scope(method='POST'),
+               [{'type': 'http.request', 'body': b'abc', 'more_body': True},
+                {'type': 'http.request', 'body': b'def', 'more_body': False}])
+    assert sent[0] == {'type': 'http.response.start', 'status': 201, 'headers': [(b'content-type', b'text/plain')]}
+    assert body_of(sent) == b'got abcdef'
+    assert sent[-1]['more_body'] is False
+
+
+def test_start_response_returns_write():
+    def app(environ, start_response):
+        write = start_response('200 OK', [])
+        write(b'written ')
+        return [b'returned']
+
+    sent = run(WSGIAdapter(app, threads=1), http_scope(), [])
+    assert sent[0]['type'] == 'http.response.start'
+    assert body_of(sent) == b'written returned'
+
+
+def test_repeated_headers_fold_with_cookie_separator():
+    seen = {}
+
+    def app(environ, start_response):
+        seen.update(environ)
+        start_response('204 No Content', [])
+        return []
+
+    run(WSGIAdapter(app, threads=1),
+        http_scope([('Cookie', 'a=1'), ('Cookie', 'b=2'), ('Accept', 'text/html'), ('Accept', 'application/json')]),
+        [])
+    assert seen['HTTP_COOKIE'] == 'a=1; b=2'
+    assert seen['HTTP_ACCEPT'] == 'text/html,application/json'
+
+
+def test_websocket_is_declined():
+    sent = run(WSGIAdapter(lambda environ, start_response: [], threads=1), {'type': 'websocket', 'path': '/'},
+               [{'type': 'websocket.connect'}])
+    assert sent == [{'type': 'websocket.close', 'code': 1000}]
+
+
+def test_lifespan_completes():
+    sent = run(WSGIAdapter(lambda environ, start_response: [], threads=1), {'type': 'lifespan'},
+               [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+    assert [message['type'] for message in sent] == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
@@ -0,0 +1,34 @@
+import os
+import time
+
+from cache import DiskCacheBackend, RecommendationCache
+
+
+def test_disk_cache_sweep_drops_expired_then_oldest(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_entries=3, ttl=60, sweep_every=1000)
+    for user_id in range(5):
+        backend.set((user_id, 'v1'), {'user': user_id})
+    now = time.time()
+    for user_id in range(5):
+        # User 0 expired; the rest were written a second apart, user 4 last
+        age = 120 if user_id == 0 else 10 - user_id
+        os.utime(backend._path((user_id, 'v1')), (now - age, now - age))
+
+    assert backend.sweep() == 2
+    assert [backend.get((user_id, 'v1'), 60) for user_id in range(5)] == [None, None, {'user': 2}, {'user': 3}, {'user': 4}]
+
+
+def test_disk_cache_sweeps_on_writes(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_entries=4, ttl=60, sweep_every=2)
+    for user_id in range(10):
+        backend.set((user_id, 'v1'), user_id)
+    remaining = sum(len(files) for _, _, files in os.walk(tmp_path))
+    assert remaining <= 4 + backend.sweep_every
+
+
+def test_local_clear_keeps_shared_entries(tmp_path):
+    cache = RecommendationCache(max_entries=10, ttl=60, backend=DiskCacheBackend(str(tmp_path)))
+    cache.set((1, 'v1'), {'recommendations': []})
+    cache.clear(shared=False)
+    assert cache.get((1, 'v1')) == {'recommendations': []}
+    assert cache.stats()['shared_hits'] == 1
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import model
+from benchmarks.precision import accuracy_case, memory_case
+from model import IdIndex, SVDModel
+
+
+def test_model_bytes_shrink_with_precision():
+    model_bytes = memory_case(n_users=2000, n_courses=500, n_factors=20, seed=0)['model_bytes']
+    # Ids and biases are not factor-sized, so the ratios sit a little above 1/2 and 1/8
+    assert model_bytes['float32'] / model_bytes['float64'] <= 0.55
+    assert model_bytes['int8'] / model_bytes['float64'] <= 0.3
+
+
+@pytest.mark.parametrize('engine', ['svd', 'als'])
+def test_reduced_precision_keeps_predictions_and_rankings(engine, monkeypatch):
+    # The reference has to be float64 whatever precision the process serves at
+    monkeypatch.setattr(model, 'MODEL_PRECISION', 'float32')
+    result = accuracy_case(n_ratings=20000, n_users=1000, n_courses=200, n_queries=50, n=10, engine=engine, seed=0)
+    variants = {variant['precision']: variant for variant in result['variants']}
+    reference = variants['float64']
+
+    assert 0 < variants['float32']['max_abs_prediction_delta'] < 1e-4
+    assert variants['float32']['top_n_overlap'] == 1.0
+    assert variants['float32']['holdout_rmse'] == pytest.approx(reference['holdout_rmse'], abs=1e-4)
+
+    assert variants['int8']['max_abs_prediction_delta'] < 0.1
+    assert variants['int8']['top_n_overlap'] >= 0.95
+    assert variants['int8']['holdout_rmse'] == pytest.approx(reference['holdout_rmse'], abs=0.01)
+
+
+@pytest.mark.parametrize('ids', [np.arange(1, 11), np.array([1, 2, 3, 5, 8, 13])])
+def test_id_index_accepts_only_whole_ids(ids):
+    index = IdIndex(ids)
+    assert index.get(5) == index.get(5.0) == index.get(np.int64(5)) == int(np.flatnonzero(ids == 5)[0])
+    assert index.get(5.5) is None
+    assert index.get(100) is None
+    assert 5.5 not in index
+    idx, known = index.lookup([5, 5.0, 5.5, 100])
+    assert known.tolist() == [True, True, False, False]
+    assert idx[0] == idx[1] == index.get(5)
+
+
+@pytest.mark.parametrize('course_ids', [np.arange(1, 11), np.array([1, 2, 3, 5, 8, 13, 21, 34, 55, 89])])
+def test_predict_and_predict_many_agree_on_fractional_ids(course_ids):
+    rng = np.random.default_rng(0)
+    scored = SVDModel([1, 2], course_ids, np.full(2, 3.5), np.full(10, 3.5),
+                      rng.normal(0, 1, (2, 4)), rng.normal(0, 1, (10, 4)), 3.5, precision='float64')
+    query = [5.0, 5.5]
+    assert scored.predict_many([1, 1], query).tolist() == pytest.approx([scored.predict(1, c) for c in query])
+    assert scored.predict(1, 5.5) == scored.global_mean
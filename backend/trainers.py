@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from instrumentation import instrumented
+from model import SVDModel, data_version, lookup_ids, train_model_from_dataframe
+
+
+class SVDTrainer:
+    name = 'svd'
+
+    def __init__(self, n_factors=50, precision=None, **_):
+        self.n_factors = n_factors
+        self.precision = precision
+
+    def train(self, df, previous=None):
+        return train_model_from_dataframe(df, max_factors=self.n_factors, precision=self.precision)
+
+
+class ALSTrainer:
+    # Regularized ALS with biases that only fits observed ratings:
+    # r_ui ~ mu + b_u + b_i + p_u . q_i
+    name = 'als'
+
+    def __init__(self, n_factors=20, iterations=10, reg=1.0, workers=1, block_size=4 * 1024 * 1024, seed=42,
+                 precision=None):
+        self.n_factors = n_factors
+        self.iterations = iterations
+        self.reg = reg
+        self.workers = workers
+        # Bytes of per-rating outer products materialized per solve block
+        self.block_size = block_size
+        self.seed = seed
+        # None stores the model at MODEL_PRECISION
+        self.precision = precision
+
+    @instrumented('als_train')
+    def train(self, df, previous=None):
+        if len(df) < 3:
+            return None
+
+        user_ids, user_codes = np.unique(df['user_id'].to_numpy(), return_inverse=True)
+        course_ids, course_codes = np.unique(df['course_id'].to_numpy(), return_inverse=True)
+        ratings = df['rating'].to_numpy(dtype=np.float64)
+        n_users = len(user_ids)
+        n_courses = len(course_ids)
+        k = max(1, min(self.n_factors, min(n_users, n_courses)))
+
+        global_mean = ratings.mean()
+        user_counts = np.bincount(user_codes, minlength=n_users)
+        course_counts = np.bincount(course_codes, minlength=n_courses)
+        user_means = np.bincount(user_codes, weights=ratings, minlength=n_users) / user_counts
+        course_means = np.bincount(course_codes, weights=ratings, minlength=n_courses) / course_counts
+
+        by_user = _group(user_codes, course_codes, ratings - global_mean, n_users)
+        by_course = _group(course_codes, user_codes, ratings - global_mean, n_courses)
+
+        rng = np.random.default_rng(self.seed)
+        user_factors = rng.normal(0, 0.1, (n_users, k))
+        course_factors = rng.normal(0, 0.1, (n_courses, k))
+        user_bias = np.zeros(n_users)
+        course_bias = np.zeros(n_courses)
+        if previous is not None:
+            # Only the course side: the first sweep solves users from these, overwriting any user warm start
+            _warm_start(previous, course_ids, course_factors, course_bias, 'course')
+
+        executor = None
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            for _ in range(self.iterations):
+                user_bias, user_factors = self._solve_side(by_user, course_factors, course_bias, executor)
+                course_bias, course_factors = self._solve_side(by_course, user_factors, user_bias, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return SVDModel(
+            user_ids, course_ids, user_means, course_means,
+            user_factors, course_factors, global_mean,
+            data_version(df, f'als:{k}:{self.iterations}:{self.reg}', self.precision),
+            user_bias=user_bias, course_bias=course_bias, precision=self.precision
+        )
+
+    def _solve_side(self, grouped, fixed_factors, fixed_bias, executor):
+        indptr, indices, targets = grouped
+        k = fixed_factors.shape[1]
+        ratings_per_block = max(1, self.block_size // (8 * (k + 1) ** 2))
+
+        tasks = []
+        for start, stop in _blocks(indptr, ratings_per_block):
+            lo, hi = indptr[start], indptr[stop]
+            block_indices = indices[lo:hi]
+            features = np.empty((hi - lo, k + 1))
+            features[:, 0] = 1.0
+            features[:, 1:] = fixed_factors[block_indices]
+            tasks.append((indptr[start:stop + 1] - lo, features,
+                          targets[lo:hi] - fixed_bias[block_indices], self.reg))
+
+        if executor is None:
+            solutions = [_solve_block(task) for task in tasks]
+        else:
+            solutions = list(executor.map(_solve_block, tasks))
+        solution = np.concatenate(solutions)
+        return solution[:, 0], solution[:, 1:]
+
+
+TRAINERS = {
+    SVDTrainer.name: SVDTrainer,
+    ALSTrainer.name: ALSTrainer,
+}
+
+
+def get_trainer(engine=None, **options):
+    if engine is None:
+        engine = os.environ.get('MODEL_ENGINE', 'svd')
+    if engine not in TRAINERS:
+        raise ValueError(f"Unknown MODEL_ENGINE '{engine}', expected one of {sorted(TRAINERS)}")
+    config = {}
+    if 'MODEL_FACTORS' in os.environ:
+        config['n_factors'] = int(os.environ['MODEL_FACTORS'])
+    if 'MODEL_ITERATIONS' in os.environ:
+        config['iterations'] = int(os.environ['MODEL_ITERATIONS'])
+    if 'MODEL_REGULARIZATION' in os.environ:
+        config['reg'] = float(os.environ['MODEL_REGULARIZATION'])
+    if 'MODEL_WORKERS' in os.environ:
+        config['workers'] = int(os.environ['MODEL_WORKERS'])
+    config.update(options)
+    return TRAINERS[engine](**config)
+
+
+def _group(row_codes, col_codes, values, n_rows):
+    order = np.argsort(row_codes, kind='stable')
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_codes, minlength=n_rows), out=indptr[1:])
+    return indptr, col_codes[order], values[order]
+
+
+def _blocks(indptr, ratings_per_block):
+    n_rows = len(indptr) - 1
+    start = 0
+    while start < n_rows:
+        limit = indptr[start] + ratings_per_block
+        stop = max(start + 1, int(np.searchsorted(indptr, limit, side='right')) - 1)
+        stop = min(stop, n_rows)
+        yield start, stop
+        start = stop
+
+
+def _solve_block(task):
+    indptr, features, targets, reg = task
+    k1 = features.shape[1]
+    outer = features[:, :, None] * features[:, None, :]
+    gram = np.add.reduceat(outer, indptr[:-1], axis=0)
+    rhs = np.add.reduceat(features * targets[:, None], indptr[:-1], axis=0)
+    gram += reg * np.eye(k1)
+    return np.linalg.solve(gram, rhs[..., None])[..., 0]
+
+
+def _warm_start(previous, ids, factors, bias, side):
+    previous_ids = np.asarray(getattr(previous, f'{side}_ids'))
+    previous_factors = getattr(previous, f'{side}_factors')
+    if np.shape(previous_factors)[1] != factors.shape[1]:
+        return
+    idx, known = lookup_ids(previous_ids, ids)
+    factors[known] = previous_factors[idx[known]]
+    bias[known] = np.asarray(getattr(previous, f'{side}_bias'))[idx[known]]